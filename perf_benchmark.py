@@ -0,0 +1,42 @@
+import json
+import argparse
+from src.perf import STAGES, REPORT_HEADER, IMPORT_HEADER, run_suite, measure_import_times, format_import_row
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure pipeline throughput offline with mock providers.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="synthetic dataset sizes (items)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--models", type=int, default=2, help="number of mock models to dispatch to")
+    parser.add_argument("--latency", choices=["constant", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--mean-latency", type=float, default=0.0, help="mock provider latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock calls that fail")
+    parser.add_argument("--burst-every", type=float, default=0, help="seconds between mock 429 bursts")
+    parser.add_argument("--burst-length", type=float, default=0, help="length of each 429 burst in seconds")
+    parser.add_argument("--json", metavar="PATH", help="also write the result rows as JSON")
+    parser.add_argument("--imports", action="store_true",
+                        help="measure run_benchmark.py subcommand import times against their budgets instead")
+    args = parser.parse_args()
+
+    if args.imports:
+        print(IMPORT_HEADER)
+        rows = measure_import_times()
+        for row in rows:
+            print(format_import_row(row))
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(rows, f, indent=4)
+        raise SystemExit(0 if all(row["within_budget"] for row in rows) else 1)
+
+    print(REPORT_HEADER)
+    rows = run_suite(args.sizes, args.stages, args.models, {
+        "latency": args.latency,
+        "mean_latency": args.mean_latency,
+        "error_rate": args.error_rate,
+        "burst_every": args.burst_every,
+        "burst_length": args.burst_length,
+    })
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=4)
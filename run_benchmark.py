@@ -1,3 +1,218 @@
-from src.benchmark import run_benchmark
+import os
+import sys
+import glob
+import time
+import argparse
+import importlib
+from src.config import (
+    CACHE_MODE, RESULTS_PATH, DATASET_CATEGORIES, BENCHMARK_CATEGORIES, RUN_BUDGET_USD, TRACE_FORMAT,
+)
+from src.sharding import parse_shard
+
+# Modules each subcommand needs. They are imported only once the subcommand is
+# chosen, so `metrics` never loads the provider SDKs and `dry-run` loads neither
+# the SDKs nor pyarrow. perf_benchmark.py --imports measures these against IMPORT_BUDGETS.
+COMMAND_MODULES = {
+    "run": ["src.benchmark"],
+    "metrics": ["src.view_metrics"],
+    "dry-run": ["src.prompts", "src.prompt_plan", "src.run_planner", "src.dataset_loader", "src.model_api"],
+    "export": ["src.results_store"],
+    "trace": ["src.tracing", "src.checkpoint"],
+    "merge": ["src.sharding", "src.checkpoint", "src.view_metrics"],
+    "sweep": ["src.sweep"],
+}
+
+
+def load_command(name):
+    """Imports the modules needed by subcommand `name`."""
+    return [importlib.import_module(module) for module in COMMAND_MODULES[name]]
+
+
+def command_run(args):
+    run_id = args.run_id if args.resume in (None, "latest") else args.resume
+    if args.shards:
+        from src.sharding import launch_shards
+        from src.checkpoint import latest_run_id
+
+        if args.resume == "latest":
+            run_id = latest_run_id()
+        run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+        options = ["--cache", args.cache, "--trace", args.trace]
+        if args.categories:
+            options += ["--categories", *args.categories]
+        if args.budget is not None:
+            options += ["--budget", str(args.budget / args.shards)]  # Each shard gets an equal share
+        if args.precision is not None:
+            sys.exit("❌ --precision (adaptive sampling) cannot be combined with --shards.")
+        if args.resume is not None:
+            options += ["--resume", run_id]
+        failed = launch_shards(args.shards, run_id, options)
+        if failed:
+            print(f"❌ Shards {', '.join(map(str, failed))} failed; rerun with `run --shards {args.shards} --resume {run_id}`.")
+            sys.exit(1)
+        command_merge(argparse.Namespace(run_id=run_id, force=False))
+        return
+
+    from src.benchmark import run_benchmark
+
+    run_benchmark(
+        cache_mode=args.cache, resume=args.resume is not None, run_id=run_id,
+        categories=args.categories, budget=args.budget, trace=args.trace, shard=args.shard,
+        precision=args.precision,
+    )
+
+
+def command_metrics(args):
+    from src.view_metrics import view_metrics
+
+    view_metrics()
+
+
+def command_dry_run(args):
+    from src.prompts import build_prompts, get_strategies, tracking_id
+    from src.prompt_plan import PromptPlan
+    from src.run_planner import RunPlanner, format_estimates
+    from src.dataset_loader import load_dataset
+    from src.model_api import PROVIDERS
+
+    # Estimates ignore the response cache and journal, so they are an upper bound
+    planner = RunPlanner(PROVIDERS, args.budget)
+    strategies = get_strategies()
+    all_prompts = []
+    sample = None
+    for category in args.categories or BENCHMARK_CATEGORIES:
+        datasets = load_dataset(category)
+        for dataset_name, dataset in datasets.get(category, {}).items():
+            prompts, metadata = build_prompts(category, dataset_name, dataset, strategies)
+            plan = PromptPlan(prompts)
+            unique_strategies = [None] * len(plan.prompts)
+            for (_, _, strategy, _), position in zip(metadata, plan.positions):
+                unique_strategies[position] = unique_strategies[position] or strategy
+            estimates = {name: planner.estimate(name, plan.prompts, unique_strategies) for name in PROVIDERS}
+
+            admitted = planner.admit(f"{category}/{dataset_name}", estimates)
+            if admitted:
+                planner.charge(sum(e["cost"] for e in estimates.values()))
+            print(f"📄 {category} / {dataset_name}: {len(dataset)} questions, {len(prompts)} prompts"
+                  f"{'' if admitted else ' (over budget, would be skipped)'}\n{format_estimates(estimates)}")
+            all_prompts.extend(prompts)
+            if sample is None and prompts:
+                sample = (tracking_id(*metadata[0]), prompts[0])
+
+    print(f"\n🧩 Prompt plan: {PromptPlan(all_prompts).summary()}")
+    print(f"💰 Planned: {planner.summary()}")
+    if args.show_prompt and sample:
+        print(f"\n--- Sample prompt ({sample[0]}) ---\n{sample[1]}")
+
+
+def command_export(args):
+    from src.results_store import export_legacy_json
+
+    count = export_legacy_json(run_id=args.run_id)
+    print(f"✅ Exported {count} partitions to {RESULTS_PATH}")
+
+
+def command_trace(args):
+    from src.tracing import trace_path, trace_report
+    from src.checkpoint import latest_run_id
+
+    run_id = args.run_id or latest_run_id()
+    path = next((p for p in (trace_path(run_id, "jsonl"), trace_path(run_id, "otlp")) if os.path.exists(p)), None)
+    # A sharded run has one trace per shard; they are reported together
+    paths = [path] if path else sorted(glob.glob(trace_path(f"{glob.escape(run_id)}.shard-*", "jsonl")))
+    if not paths:
+        print(f"❌ No trace found for run {run_id}.")
+        return
+    print(f"🧭 Trace {', '.join(paths)}\n{trace_report(paths, args.slowest)}")
+
+
+def command_merge(args):
+    from src.sharding import merge_shards
+    from src.checkpoint import latest_run_id
+    from src.view_metrics import view_metrics
+
+    run_id = args.run_id or latest_run_id()
+    count = merge_shards(run_id, force=args.force)
+    print(f"✅ Merged run {run_id}: exported {count} partitions to {RESULTS_PATH}")
+    view_metrics()
+
+
+def command_sweep(args):
+    from src.sweep import load_spec, run_sweep
+
+    run_id = None if args.resume in (None, "latest") else args.resume
+    run_sweep(load_spec(args.spec), cache_mode=args.cache, resume=args.resume is not None, run_id=run_id)
+
+
+COMMANDS = {
+    "run": command_run,
+    "metrics": command_metrics,
+    "dry-run": command_dry_run,
+    "export": command_export,
+    "trace": command_trace,
+    "merge": command_merge,
+    "sweep": command_sweep,
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run the IndicEval benchmark.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run = subparsers.add_parser("run", help="query the models and score their answers (default)")
+    run.add_argument("--cache", choices=["use", "refresh", "off"], default=CACHE_MODE,
+                     help="use cached responses, refresh them by re-querying, or bypass the cache")
+    run.add_argument("--resume", nargs="?", const="latest", metavar="RUN_ID",
+                     help="replay the journal of RUN_ID (default: latest run) and query only missing prompts")
+    run.add_argument("--categories", nargs="+", choices=sorted(DATASET_CATEGORIES), metavar="CATEGORY",
+                     help=f"dataset categories to evaluate (default: {' '.join(BENCHMARK_CATEGORIES)})")
+    run.add_argument("--trace", choices=["jsonl", "otlp", "off"], default=TRACE_FORMAT,
+                     help="write stage and request spans to runs/traces/<run_id>.jsonl, as OTLP JSON, or not at all")
+    run.add_argument("--budget", type=float, default=RUN_BUDGET_USD, metavar="USD",
+                     help="hard spend limit; datasets whose estimate does not fit are skipped whole")
+    run.add_argument("--precision", type=float, metavar="POINTS",
+                     help="adaptive sampling: stop each dataset once every model/strategy accuracy is known to "
+                          "+/- POINTS (CI half-width) and report the calls saved")
+    run.add_argument("--run-id", help="id of a new run (default: current time); shards of one run share it")
+    sharding = run.add_mutually_exclusive_group()
+    sharding.add_argument("--shard", type=parse_shard, metavar="I/N",
+                          help="only run shard I (0-based) of N, e.g. one per host with the same --run-id")
+    sharding.add_argument("--shards", type=int, metavar="N",
+                          help="run N shards as local processes, then merge them")
+
+    subparsers.add_parser("metrics", help="recompute metrics from the results store")
+
+    dry_run = subparsers.add_parser("dry-run", help="build every prompt and estimate calls, tokens, cost and time offline")
+    dry_run.add_argument("--categories", nargs="+", choices=sorted(DATASET_CATEGORIES), metavar="CATEGORY",
+                         help=f"dataset categories to plan (default: {' '.join(BENCHMARK_CATEGORIES)})")
+    dry_run.add_argument("--budget", type=float, default=RUN_BUDGET_USD, metavar="USD",
+                         help="show which datasets a run with this spend limit would skip")
+    dry_run.add_argument("--show-prompt", action="store_true", help="print the first prompt")
+
+    export = subparsers.add_parser("export", help="write results/<model>/<strategy>/<dataset>.json from the store")
+    export.add_argument("--run-id", help="run to export (default: latest version of every partition)")
+
+    trace = subparsers.add_parser("trace", help="summarise a run's trace: dominant stages and slowest prompts")
+    trace.add_argument("run_id", nargs="?", help="run to report (default: latest run)")
+    trace.add_argument("--slowest", type=int, default=10, help="number of slowest prompts to list")
+
+    merge = subparsers.add_parser("merge", help="check every shard of a sharded run finished, export results/ and compute metrics")
+    merge.add_argument("run_id", nargs="?", help="sharded run to merge (default: latest run)")
+    merge.add_argument("--force", action="store_true", help="merge even if some shards have not finished")
+
+    sweep = subparsers.add_parser("sweep", help="run a models x strategies x k x temperature grid from a TOML/YAML spec")
+    sweep.add_argument("spec", help="sweep spec, e.g. sweeps/example.toml")
+    sweep.add_argument("--cache", choices=["use", "refresh", "off"], default=CACHE_MODE,
+                       help="use cached responses, refresh them by re-querying, or bypass the cache")
+    sweep.add_argument("--resume", nargs="?", const="latest", metavar="RUN_ID",
+                       help="replay the journal of RUN_ID (default: latest run) and query only missing prompts")
+    return parser
+
+
 if __name__ == "__main__":
-    run_benchmark()
+    # `python run_benchmark.py [--cache ...] [--resume ...]` keeps meaning `run`
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"):
+        argv = ["run"] + argv
+    args = build_parser().parse_args(argv)
+    COMMANDS[args.command](args)
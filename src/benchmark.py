@@ -1,164 +1,298 @@
-import os
-import json
-from src.dataset_loader import load_dataset
-from src.model_api import batch_query   
-from src.post_process import extract_option_label  
+import time
+from collections import Counter
+from src.dataset_loader import load_dataset, question_id
+from src.model_api import PROVIDERS, batch_query, pending_prompts
+from src.dispatcher import Failure
+from src.post_process import extract_option_labels  
 from src.view_metrics import view_metrics  
-from .config import RESULTS_PATH, STRATEGY_MODE
-
-
-
-def format_prompt(question, options, strategy, dataset=None, k=3, current_index=0):
-    """Formats the prompt based on the selected strategy and language."""
-    options_text = "\n".join(options)
-
-    # Language detection: check if question is in Hindi (Devanagari script)
-    def is_hindi(text):
-        return any('\u0900' <= ch <= '\u097F' for ch in text)
-
-    is_hindi_lang = is_hindi(question)
-
-    if strategy == "zero-shot":
-        instruction = (
-            "कृपया (a, b, c, या d) में से एक उत्तर चुनें। उत्तर:"
-            if is_hindi_lang else
-            "Answer with A, B, C, or D:"
+from src.response_cache import open_cache
+from src.checkpoint import RunJournal
+from src.prompts import build_prompts, get_strategies, tracking_id
+from src.results_store import ResultsStore, export_legacy_json
+from src.run_planner import RunPlanner, combine_estimates, format_estimates
+from src.sharding import shard_assignments, shard_name, mark_shard_done
+from src.sampling import AdaptiveSampler, stratified_order
+from src import tracing
+from .config import (
+    RESULTS_PATH, RESULTS_STORE_PATH, CACHE_MODE, EXPORT_LEGACY_JSON, BENCHMARK_CATEGORIES, RUN_BUDGET_USD,
+    TRACE_FORMAT, RESULT_CHUNK_SIZE, ADAPTIVE_BATCH_SIZE,
+)
+
+
+def estimate_chunk(planner, category, dataset_name, dataset, strategies, indices, cache=None, journal=None, shard=None):
+    """Per-model estimates ({name: estimate}) of the prompts one chunk of questions would still send."""
+    prompts, metadata = build_prompts(category, dataset_name, dataset, strategies, indices)
+    assignments = shard_assignments(list(PROVIDERS), prompts, shard)
+    pending = pending_prompts(prompts, cache=cache, journal=journal, assignments=assignments)
+    return {
+        name: planner.estimate(name, [prompts[i] for i in selected], [metadata[i][2] for i in selected])
+        for name, selected in pending.items()
+    }
+
+
+def write_model_results(store, model_name, dataset_name, dataset, metadata, responses, planner=None, label=None):
+    """
+    Scores one model's responses to a chunk of prompts (metadata[i] is
+    (category, dataset, strategy, index)) and appends them to the store, one
+    partition per strategy, or under `label` instead of the strategy name (sweeps
+    store few-shot_k5 and few-shot_k1 apart). Returns {strategy: written columns}.
+    """
+    items = [dataset[index] for _, _, _, index in metadata]
+    question_ids = [question_id(dataset_name, index) for _, _, _, index in metadata]
+
+    # Failed requests are stored as failed (no answer, no score) rather than as wrong answers
+    errors = [response.kind if isinstance(response, Failure) else None for response in responses]
+    responses = [None if error else response for response, error in zip(responses, errors)]
+    if planner is not None:
+        for strategy in {strategy for _, _, strategy, _ in metadata}:
+            planner.calibration.record_responses(model_name, strategy, [
+                response for response, (_, _, s, _) in zip(responses, metadata) if s == strategy
+            ])
+
+    with tracing.span("extract", model=model_name, dataset=dataset_name):
+        labels, rules = extract_option_labels(
+            [response or "" for response in responses],
+            [item["options"] for item in items],
+            [strategy for _, _, strategy, _ in metadata],
         )
-        return f"{question}\nOptions:\n{options_text}\n{instruction}"
-
-    elif strategy == "few-shot":
-        assert dataset is not None, "Dataset required for few-shot prompting."
-        few_shot_examples = []
-        count = 0
+    for rule, hits in Counter(rule for rule, error in zip(rules, errors) if not error).items():
+        tracing.count("extraction_rule", hits, model=model_name, dataset=dataset_name, rule=str(rule))
+    for error, hits in Counter(error for error in errors if error).items():
+        tracing.count("failed_request", hits, model=model_name, dataset=dataset_name, kind=error)
+
+    partitions = {}
+    for i, (category, dataset_name, strategy, index) in enumerate(metadata):
+        item = items[i]
+
+        if errors[i]:
+            predicted_label = is_correct = None
+        else:
+            predicted_label = labels[i] if responses[i] else "N/A"
+            is_correct = predicted_label == item["label"].lower()
+
+        columns = partitions.setdefault(strategy, {
+            "question_id": [], "index": [], "model_answer": [], "predicted_answer": [],
+            "correct_answer": [], "is_correct": [], "extraction_rule": [], "error": [],
+        })
+        columns["question_id"].append(question_ids[i])
+        columns["index"].append(index)
+        columns["model_answer"].append(responses[i])
+        columns["predicted_answer"].append(predicted_label)
+        columns["correct_answer"].append(item["label"])
+        columns["is_correct"].append(is_correct)
+        columns["extraction_rule"].append(None if errors[i] else rules[i])
+        columns["error"].append(errors[i])
+
+    for strategy, columns in partitions.items():
+        with tracing.span("write_results", model=model_name, dataset=dataset_name, strategy=label or strategy):
+            store.write_results(model_name, label or strategy, dataset_name, columns)
+    return partitions
+
+
+def process_dataset(category, cache=None, journal=None, store=None, savings=None, planner=None, shard=None,
+                    precision=None):
+    """Processes a dataset using batch processing for multiple models.
+
+    Results are written to `store` (a ResultsStore; a new run is started when
+    omitted) and returned as {model: {category: {dataset: {strategy: partition path}}}}.
+    With a `planner` (RunPlanner), each dataset's tokens, cost and time are
+    estimated first and datasets that do not fit the remaining budget are skipped;
+    once the actual spend reaches the limit, no further chunk is dispatched.
+    With `shard` = (I, N), only the (model, strategy, dataset, index) work units
+    owned by shard I are queried and written (see sharding.py).
+
+    Datasets are processed RESULT_CHUNK_SIZE questions at a time: a chunk's
+    prompts are built, dispatched, scored and appended to the store before the
+    next chunk is built, so memory stays flat whatever the dataset size.
+
+    With `precision` (accuracy points), questions are sampled instead: batches of
+    ADAPTIVE_BATCH_SIZE in a language-stratified random order, until every
+    model and strategy's accuracy CI is within +/- precision (see
+    AdaptiveSampler). Calls a full run would have made and calls skipped are
+    added to `savings` as full_run_calls and sampled_out_calls.
+    """
+    with tracing.span("load_dataset", category=category):
+        datasets = load_dataset(category)
+    results = {}
+    store = store or ResultsStore(time.strftime("%Y%m%d-%H%M%S"))
 
-        for idx, example in enumerate(dataset):
-            if idx == current_index:
-                continue  # Skip current question
+    strategies = get_strategies()
 
-            example_lang = is_hindi(example['question'])
-            instruction = (
-                "उत्तर:" if example_lang else "Answer:"
+    # Process each dataset separately (for example, UPSC English and UPSC Hindi)
+    for dataset_name in datasets.get(category, []):
+        dataset = datasets[category][dataset_name]
+        sampler = None
+        if precision is None:
+            chunks = [range(start, min(start + RESULT_CHUNK_SIZE, len(dataset)))
+                      for start in range(0, len(dataset), RESULT_CHUNK_SIZE)]
+        else:
+            order = stratified_order(dataset)
+            chunks = [order[start:start + ADAPTIVE_BATCH_SIZE] for start in range(0, len(order), ADAPTIVE_BATCH_SIZE)]
+            sampler = AdaptiveSampler(precision)
+
+        if planner is not None:
+            with tracing.span("estimate", dataset=dataset_name):
+                estimates = combine_estimates(
+                    estimate_chunk(planner, category, dataset_name, dataset, strategies, indices, cache, journal, shard)
+                    for indices in chunks
+                )
+            print(f"💰 Estimate for {category} / {dataset_name}:\n{format_estimates(estimates)}")
+            if not planner.admit(f"{category}/{dataset_name}", estimates):
+                print(f"⏭️ Skipping {category} / {dataset_name}: ${planner.spent:.4f} of ${planner.limit:.2f} already spent")
+                continue
+
+        # Question text is stored once per dataset, results only reference it by id
+        with tracing.span("write_results", dataset=dataset_name, table="questions"):
+            store.write_questions(dataset_name, (
+                ([question_id(dataset_name, index) for index in indices], list(indices),
+                 [dataset[index]["question"] for index in indices])
+                for indices in chunks
+            ))
+
+        asked = 0
+        for number, indices in enumerate(chunks):
+            if planner is not None and planner.exhausted():
+                print(f"💸 Budget of ${planner.limit:.2f} spent (${planner.spent:.4f}): stopping {category} / {dataset_name} "
+                      f"after {asked} of {len(dataset)} questions")
+                planner.skipped.append(f"{category}/{dataset_name} (after {asked} questions)")
+                break
+            if len(chunks) > 1:
+                print(f"📦 {dataset_name}: {'batch' if sampler else 'chunk'} {number + 1}/{len(chunks)} ({len(indices)} questions)")
+            with tracing.span("build_prompts", dataset=dataset_name):
+                prompts, metadata = build_prompts(category, dataset_name, dataset, strategies, indices)
+            assignments = shard_assignments(list(PROVIDERS), prompts, shard)
+
+            model_responses = batch_query(
+                prompts, cache=cache, journal=journal, savings=savings, planner=planner,
+                labels=[tracking_id(*unit) for unit in metadata],
+                assignments=assignments if shard else None, strategies=[unit[2] for unit in metadata],
             )
 
-            formatted_example = (
-                f"Q: {example['question']}\nOptions:\n" +
-                "\n".join(example["options"]) +
-                f"\n{instruction} {example['label']}"
-            )
-            few_shot_examples.append(formatted_example)
-            count += 1
-            if count >= k:
+            # Reorganize results per model into one columnar partition per strategy
+            for model_name, responses in model_responses.items():
+                selected = assignments[model_name]
+                if not selected:
+                    continue
+                written = write_model_results(
+                    store, model_name, dataset_name, dataset,
+                    [metadata[i] for i in selected], [responses[i] for i in selected], planner,
+                )
+                for strategy, columns in written.items():
+                    results.setdefault(model_name, {}).setdefault(category, {}).setdefault(dataset_name, {})[strategy] = (
+                        store.partition_path(model_name, strategy, dataset_name)
+                    )
+                    if sampler is not None:
+                        sampler.add((model_name, strategy), columns)
+
+            asked += len(indices)
+            if sampler is not None and sampler.done():
                 break
 
-        instruction_final = (
-            "उत्तर:" if is_hindi_lang else "Answer:"
-        )
-
-        few_shot_prompt = "\n\n".join(few_shot_examples)
-        return f"{few_shot_prompt}\n\nQ: {question}\nOptions:\n{options_text}\n{instruction_final}"
-
-    elif strategy == "cot":
-        instruction = (
-            "कृपया चरण दर चरण सोचें और फिर (a, b, c, या d) में से उत्तर दें:"
-            if is_hindi_lang else
-            "Think step by step and then answer with A, B, C, or D:"
-        )
-        return f"{question}\nOptions:\n{options_text}\n{instruction}"
-
-    else:
-        raise ValueError("Invalid prompting strategy.")
-
+        if sampler is not None:
+            full = len(dataset) * len(strategies) * len(PROVIDERS)
+            skipped = (len(dataset) - asked) * len(strategies) * len(PROVIDERS)
+            print(f"🎯 {dataset_name}: sampled {asked} of {len(dataset)} questions, "
+                  f"{'target precision reached' if sampler.done() else 'target precision not reached'}\n{sampler.summary()}")
+            if savings is not None:
+                savings["full_run_calls"] += full
+                savings["sampled_out_calls"] += skipped
+
+        store.close()  # Part files are only readable once their footers are written
+
+        if EXPORT_LEGACY_JSON and shard is None:  # Sharded runs export once every shard is merged
+            with tracing.span("export_json", dataset=dataset_name):
+                export_legacy_json(
+                    store.run_id,
+                    partitions={(model, strategy, dataset_name) for model in PROVIDERS for strategy in strategies},
+                    root=store.root,
+                )
 
-def process_dataset(category):
-    """Processes a dataset using batch processing for multiple models."""
-    datasets = load_dataset(category)
-    results = {}
+    return results
 
-    strategies = ["zero-shot", "few-shot", "cot"] if STRATEGY_MODE == "all" else [STRATEGY_MODE]
 
-    # Process each dataset separately (for example, UPSC English and UPSC Hindi)
-    for dataset_name in datasets.get(category, []):
-        dataset = datasets[category][dataset_name]
-        
-        all_prompts = []
-        all_prompt_metadata = []  # (dataset_name, strategy, question_index)
-
-        # Collect prompts for the current dataset and strategies
-        for strategy in strategies:
-            for index, item in enumerate(dataset):
-                formatted_prompt = format_prompt(
-                    item["question"], item["options"], strategy, dataset=dataset, current_index=index
-                )
-                # Unique identifier for each prompt
-                prompt_with_id = f"Q_{category}_{dataset_name}_{strategy}_{index + 1}:\n{formatted_prompt}"
-                all_prompts.append(prompt_with_id)
-                all_prompt_metadata.append((category, dataset_name, strategy, index))
-
-        # Run batch once for this dataset only
-        model_responses = batch_query(all_prompts)
-
-        # Reorganize results per model
-        for model_name, responses in model_responses.items():
-            per_model_data = {}
-
-            for i, (category, dataset_name, strategy, index) in enumerate(all_prompt_metadata):
-                dataset = datasets[category][dataset_name]
-                item = dataset[index]
-
-                predicted_label = extract_option_label(responses[i], item["options"], strategy) if responses[i] else "N/A"
-                is_correct = predicted_label == item["label"].lower()
-
-                result_entry = {
-                    "question": item["question"],
-                    "model": model_name,
-                    "model_answer": responses[i],
-                    "correct_answer": item["label"],
-                    "predicted_answer": predicted_label,
-                    "is_correct": is_correct,
-                    "strategy": strategy,
-                }
-
-                # Structure results by category, dataset, and strategy
-                if category not in per_model_data:
-                    per_model_data[category] = {}
-                if dataset_name not in per_model_data[category]:
-                    per_model_data[category][dataset_name] = {}
-                if strategy not in per_model_data[category][dataset_name]:
-                    per_model_data[category][dataset_name][strategy] = []
-                per_model_data[category][dataset_name][strategy].append(result_entry)
-
-            # Save to files for the current dataset
-            for category, category_data in per_model_data.items():
-                for dataset_name, strat_data in category_data.items():
-                    for strategy, entries in strat_data.items():
-                        result_dir = os.path.join(RESULTS_PATH, model_name, strategy)
-                        os.makedirs(result_dir, exist_ok=True)
-                        result_path = os.path.join(result_dir, f"{dataset_name}.json")
-                        with open(result_path, "w", encoding="utf-8") as f:
-                            json.dump(entries, f, indent=4, ensure_ascii=False)
-
-            results[model_name] = per_model_data
 
-    return results
 
+def run_benchmark(cache_mode=CACHE_MODE, resume=False, run_id=None, categories=None, budget=RUN_BUDGET_USD,
+                  trace=TRACE_FORMAT, shard=None, precision=None):
+    """Runs benchmarking sequentially for different dataset categories (one at a time).
 
+    Every response is journaled under runs/<run_id>.jsonl; with resume=True the
+    journal of `run_id` (or of the latest run) is replayed and only missing
+    prompts are dispatched. `budget` is a hard spend limit in USD (None for none),
+    enforced per dataset in category order. Unless `trace` is "off", stage and
+    request spans are written to runs/traces/<run_id>.jsonl (or .otlp.jsonl) and
+    summarised at the end.
 
+    With `shard` = (I, N) the run only does shard I's share of the work, under
+    `run_id` in the shared results store, with its own journal and trace
+    (<run_id>.shard-I-of-N). Metrics and the results/ export wait for
+    sharding.merge_shards() once all N shards have finished.
 
-def run_benchmark():
-    """Runs benchmarking sequentially for different dataset categories (one at a time)."""
-    categories = ["Law"]  # Add more categories if needed "UPSC,Physics,Law,Biology"
+    With `precision` (accuracy points), each dataset is sampled adaptively until
+    every model and strategy is known to +/- precision (see process_dataset).
+    """
+    categories = categories or BENCHMARK_CATEGORIES
+    if precision is not None and shard is not None:
+        raise ValueError("❌ Adaptive sampling needs every answer of a dataset in one process; it cannot be sharded.")
 
     final_results = {}
+    savings = Counter()
+    planner = RunPlanner(PROVIDERS, budget)
+    cache = open_cache(cache_mode)
+    journal = RunJournal(run_id, resume=resume, shard=shard)
+    store = ResultsStore(journal.run_id, shard=shard)
+    label = journal.run_id if shard is None else f"{journal.run_id}.{shard_name(shard)}"
+    print(f"🧾 Run {label} journal: {journal.path}")
+    if trace != "off":
+        tracing.start_trace(label, trace)
+
+    try:
+        with tracing.span("run", run_id=journal.run_id):
+            for category in categories:
+                print(f"🔍 Processing category: {category}...")
+                with tracing.span("category", category=category):
+                    result = process_dataset(
+                        category, cache=cache, journal=journal, store=store, savings=savings, planner=planner,
+                        shard=shard, precision=precision,
+                    )
+                final_results[category] = result
+    except BaseException:
+        tracing.finish_trace()  # Keep the trace of a failed run for diagnosis
+        raise
+    finally:
+        store.close()  # Chunks written before a crash stay readable
+        journal.close()
+        if cache is not None:
+            print(f"📦 {cache.summary()}")
+            cache.close()
+        print(
+            f"🧩 Prompt planning saved {savings['duplicate_calls'] + savings['reused_calls']} calls "
+            f"(~{savings['duplicate_tokens'] + savings['reused_tokens']} prompt tokens): "
+            f"{savings['duplicate_calls']} duplicates, {savings['reused_calls']} answered by the journal or cache; "
+            f"~{savings['prefix_tokens']} prompt tokens sit in shared prefixes"
+        )
+        if savings["full_run_calls"]:
+            print(
+                f"🎯 Adaptive sampling skipped {savings['sampled_out_calls']} of the {savings['full_run_calls']} calls "
+                f"a full run would make ({savings['sampled_out_calls'] / savings['full_run_calls'] * 100:.1f}%)"
+            )
+        planner.calibration.save()
+        print(f"💰 Spent {planner.summary()}")
 
-    for category in categories:
-        print(f"🔍 Processing category: {category}...")
-        result = process_dataset(category)
-        final_results[category] = result
+    if shard is not None:
+        mark_shard_done(journal.run_id, shard, {"categories": categories, "spent": planner.spent, "skipped": planner.skipped})
+        print(f"✅ Shard {shard[0]}/{shard[1]} of run {journal.run_id} completed! Results saved in {RESULTS_STORE_PATH}; "
+              f"once every shard is done, run `python run_benchmark.py merge {journal.run_id}`")
+    else:
+        print(f"✅ Benchmarking completed! Results saved in {RESULTS_STORE_PATH}" +
+              (f" and {RESULTS_PATH}" if EXPORT_LEGACY_JSON else ""))
 
-    print(f"✅ Benchmarking completed! Results saved in {RESULTS_PATH}")
+        # Compute and display accuracy metrics
+        view_metrics()
 
-    # Compute and display accuracy metrics
-    view_metrics()
+    path = tracing.finish_trace()
+    if path:
+        print(f"\n🧭 Trace saved in {path}\n{tracing.trace_report([path])}")
 
 if __name__ == "__main__":
     run_benchmark()
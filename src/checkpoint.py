@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import hashlib
+from .config import RUNS_PATH
+
+FSYNC_EVERY = 50  # Records between fsyncs; every record is flushed to the OS immediately
+
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def latest_run_id():
+    """Returns the id of the most recently written run journal (of any of its shards), or None."""
+    if not os.path.isdir(RUNS_PATH):
+        return None
+    journals = [f for f in os.listdir(RUNS_PATH) if f.endswith(".jsonl")]
+    if not journals:
+        return None
+    latest = max(journals, key=lambda f: os.path.getmtime(os.path.join(RUNS_PATH, f)))
+    return latest[:-len(".jsonl")].split(".")[0]  # <run_id>.shard-I-of-N.jsonl belongs to <run_id>
+
+
+class RunJournal:
+    """
+    Append-only JSONL journal of every response received during a run.
+    Each line is {"model", "prompt" (sha256), "response"}; a journal reopened
+    for resume replays these so only unanswered prompts are dispatched again.
+    Only the byte offset of each record is kept in memory; lookup() reads the
+    response back from the file.
+    Each shard of a sharded run keeps its own journal, runs/<run_id>.shard-I-of-N.jsonl.
+    """
+
+    def __init__(self, run_id=None, resume=False, shard=None):
+        if resume and run_id is None:
+            run_id = latest_run_id()
+            if run_id is None:
+                raise FileNotFoundError(f"❌ No run journal found in '{RUNS_PATH}' to resume.")
+        self.run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+        name = self.run_id if shard is None else f"{self.run_id}.shard-{shard[0]}-of-{shard[1]}"
+        self.path = os.path.join(RUNS_PATH, f"{name}.jsonl")
+        self.answered = {}  # (model, prompt hash) -> byte offset of its record
+        self.reader = None
+
+        if resume:
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(f"❌ Run journal '{self.path}' not found.")
+            self._replay()
+
+        os.makedirs(RUNS_PATH, exist_ok=True)
+        self.file = open(self.path, "ab")
+        if self.file.tell() and not self._ends_with_newline():
+            self.file.write(b"\n")  # Terminate a partial line from a crash mid-write
+        self.unsynced = 0
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _replay(self):
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = None  # Partial line from a crash mid-write
+                if record is not None:
+                    self.answered[(record["model"], record["prompt"])] = offset
+                offset += len(line)
+        print(f"♻️ Resuming run {self.run_id}: {len(self.answered)} responses replayed from journal")
+
+    def contains(self, model_name, prompt):
+        return (model_name, prompt_hash(prompt)) in self.answered
+
+    def lookup(self, model_name, prompt):
+        offset = self.answered.get((model_name, prompt_hash(prompt)))
+        if offset is None:
+            return None
+        if self.reader is None:
+            self.reader = open(self.path, "rb")
+        self.reader.seek(offset)
+        return json.loads(self.reader.readline())["response"]
+
+    def record(self, model_name, prompt, response):
+        key = prompt_hash(prompt)
+        self.answered[(model_name, key)] = self.file.tell()
+        line = json.dumps({"model": model_name, "prompt": key, "response": response}, ensure_ascii=False) + "\n"
+        self.file.write(line.encode("utf-8"))
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= FSYNC_EVERY:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        if self.reader is not None:
+            self.reader.close()
@@ -14,10 +14,64 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Paths relative to the root directory
 DATASET_PATH = os.path.join(BASE_DIR, "data")
 RESULTS_PATH = os.path.join(BASE_DIR, "results")
+RESULTS_STORE_PATH = os.path.join(BASE_DIR, "results_store")  # Columnar (Parquet) results
+METRICS_CACHE_PATH = os.path.join(RESULTS_STORE_PATH, "metrics")  # Per-partition metric summaries
 LOG_PATH = os.path.join(BASE_DIR, "logs", "evaluation_log.txt")
+CACHE_PATH = os.path.join(BASE_DIR, "cache", "responses.sqlite")
+RUNS_PATH = os.path.join(BASE_DIR, "runs")  # Per-run response journals
+CALIBRATION_PATH = os.path.join(BASE_DIR, "cache", "token_calibration.json")  # Measured token usage per model
 
 STRATEGY_MODE = "few-shot"
 
+# Few-shot exemplar selection: "first-k", "random" (seeded) or "nearest" (lexical similarity)
+FEW_SHOT_POLICY = "first-k"
+FEW_SHOT_SEED = 0
+
+# Dispatch budgets per provider: requests/min, tokens/min and concurrent requests.
+# Adjust to the quota tier of your API keys.
+PROVIDER_LIMITS = {
+    "gemini": {"rpm": 1000, "tpm": 1000000, "concurrency": 20},
+    "together": {"rpm": 600, "tpm": 500000, "concurrency": 20},
+}
+
+# Run planner: prices in USD per 1M tokens (providers without a price count as free),
+# expected response tokens per strategy until measured, and a hard spend limit per run
+# in USD (None for no limit; `run --budget` overrides it)
+PROVIDER_PRICING = {
+    "gemini": {"input": 0.10, "output": 0.40},
+    "together": {"input": 0.88, "output": 0.88},
+}
+OUTPUT_TOKEN_ESTIMATES = {"zero-shot": 16, "few-shot": 16, "cot": 384}
+RUN_BUDGET_USD = None
+
+# Per-run trace of stage and request spans: "jsonl", "otlp" (OpenTelemetry JSON) or "off"
+TRACE_FORMAT = "jsonl"
+
+# Also write the legacy results/<model>/<strategy>/<dataset>.json files after each dataset
+EXPORT_LEGACY_JSON = True
+
+# Parameter sweeps (`run_benchmark.py sweep spec.toml`): questions per dataset in each
+# interleaved round, and questions a cell needs before it may stop early
+SWEEP_ROUND_SIZE = 50
+SWEEP_MIN_QUESTIONS = 100
+
+# Adaptive sampling (`run --precision 2`): questions per batch, and scored answers each
+# model/strategy needs before its confidence interval may stop a dataset
+ADAPTIVE_BATCH_SIZE = 100
+ADAPTIVE_MIN_QUESTIONS = 100
+
+# Questions per chunk: each chunk's prompts are built, dispatched, scored and appended
+# to the results store before the next one, so memory stays flat whatever the dataset size
+RESULT_CHUNK_SIZE = 1000
+
+# Metrics: bootstrap resamples and confidence level for accuracy intervals
+BOOTSTRAP_RESAMPLES = 2000
+CONFIDENCE = 0.95
+
+# Response cache: "use" (read + write), "refresh" (re-query and overwrite) or "off"
+CACHE_MODE = "use"
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
 DATASET_CATEGORIES = {
     "UPSC": ["upsc", "upsc_hindi"],
     "Physics": ["neet_physics", "neet_hindi_physics"],
@@ -26,6 +80,9 @@ DATASET_CATEGORIES = {
     "Law": ["lsat_lr"],
 }
 
+# Categories evaluated by `run` and `dry-run` unless --categories is given
+BENCHMARK_CATEGORIES = ["Law"]  # Add more categories if needed "UPSC,Physics,Law,Biology"
+
 # Ensure directories exist
 os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
 os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
@@ -1,11 +1,303 @@
 import os
 import json
+import random
+from array import array
 from .config import DATASET_PATH, DATASET_CATEGORIES
 
+META_VERSION = 1  # Bump when the metadata index layout changes
+_metadata = {}
+
+
+def question_id(dataset_name, index):
+    """Stable identifier of a dataset item, shared by every model and strategy."""
+    return f"{dataset_name}:{index}"
+
+
+def is_hindi(text):
+    """Checks if text is in Hindi (Devanagari script)."""
+    return any('\u0900' <= ch <= '\u097F' for ch in text)
+
+
+def english_counterpart(dataset_name):
+    """neet_hindi_physics -> neet_physics, upsc_hindi -> upsc; None for English datasets."""
+    parts = dataset_name.split("_")
+    return "_".join(p for p in parts if p != "hindi") if "hindi" in parts else None
+
+
+def _index_path(path):
+    return path + ".idx"
+
+
+def _build_offsets(path):
+    """Byte offset of every non-empty line in a .jsonl file."""
+    offsets = array("Q")
+    position = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                offsets.append(position)
+            position += len(line)
+    return offsets
+
+
+def load_offsets(path):
+    """
+    Loads the byte-offset index stored next to a .jsonl file, rebuilding it
+    when the file has changed since the index was written.
+    Index layout: [file size, mtime_ns, offset_0, offset_1, ...] as uint64.
+    """
+    stat = os.stat(path)
+    index_file = _index_path(path)
+
+    if os.path.exists(index_file):
+        stored = array("Q")
+        with open(index_file, "rb") as f:
+            stored.frombytes(f.read())
+        if len(stored) >= 2 and stored[0] == stat.st_size and stored[1] == stat.st_mtime_ns:
+            return stored[2:]
+
+    offsets = _build_offsets(path)
+    try:
+        # Written aside and swapped in, so processes starting together never read a partial index
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            array("Q", [stat.st_size, stat.st_mtime_ns]).tofile(f)
+            offsets.tofile(f)
+        os.replace(tmp_file, index_file)
+    except OSError:
+        pass  # Read-only data directory: keep the index in memory only
+    return offsets
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _build_metadata(path):
+    """Script, option count, answer label and question length of every item of a .jsonl file."""
+    languages, options, labels, lengths = [], [], [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                languages.append("h" if is_hindi(item["question"]) else "e")
+                options.append(len(item["options"]))
+                labels.append(str(item["label"]).strip().lower())
+                lengths.append(len(item["question"]))
+    return {"languages": "".join(languages), "options": options, "labels": labels, "lengths": lengths}
+
+
+class DatasetIndex:
+    """
+    Per-item metadata of a .jsonl dataset, so prompt building, sampling and
+    paired metrics need not parse or scan items: language ("hi" for Devanagari
+    questions, else "en"), option count, answer label, question length and, for
+    a Hindi dataset with an English original (upsc_hindi -> upsc), the parallel
+    English item. Item i is paired with English item i when both exist with the
+    same option count and answer label.
+    Built once and stored next to the file as <file>.meta.json; like the offset
+    index, it is rebuilt when the file or its English original changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.key = _file_key(path)
+        meta_file = path + ".meta.json"
+
+        meta = None
+        if os.path.exists(meta_file):
+            with open(meta_file, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != META_VERSION or meta.get("key") != self.key:
+                meta = None
+        changed = meta is None
+        if changed:
+            meta = {"version": META_VERSION, "key": self.key, **_build_metadata(path)}
+
+        self.counterpart = english_counterpart(self.name)
+        english_path = os.path.join(os.path.dirname(path), f"{self.counterpart}.jsonl") if self.counterpart else None
+        if english_path and os.path.exists(english_path):
+            pair = meta.get("pair")
+            if not pair or pair["dataset"] != self.counterpart or pair["key"] != _file_key(english_path):
+                english = dataset_index(english_path)
+                meta["pair"] = {"dataset": self.counterpart, "key": english.key, "items": [
+                    i if i < len(english) and (english.options[i], english.labels[i]) == (options, label) else -1
+                    for i, (options, label) in enumerate(zip(meta["options"], meta["labels"]))
+                ]}
+                changed = True
+        else:
+            self.counterpart = None
+            changed = meta.pop("pair", None) is not None or changed
+
+        if changed:
+            try:
+                tmp_file = f"{meta_file}.{os.getpid()}.tmp"
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump(meta, f)
+                os.replace(tmp_file, meta_file)
+            except OSError:
+                pass  # Read-only data directory: keep the index in memory only
+
+        self.languages = meta["languages"]
+        self.options = meta["options"]
+        self.labels = meta["labels"]
+        self.lengths = meta["lengths"]
+        self.pairs = meta["pair"]["items"] if self.counterpart else None
+        # Changes whenever the items or their pairing do, for caches of derived results
+        self.fingerprint = [self.key, meta["pair"]["key"] if self.counterpart else None]
+
+    def __len__(self):
+        return len(self.languages)
+
+    def language(self, index):
+        return "hi" if self.languages[index] == "h" else "en"
+
+    def option_count(self, index):
+        return self.options[index]
+
+    def length(self, index):
+        return self.lengths[index]
+
+    def question_id(self, index):
+        return question_id(self.name, index)
+
+    def pair(self, index):
+        """Index of the parallel item in the English dataset self.counterpart, or None."""
+        if self.pairs is None or self.pairs[index] < 0:
+            return None
+        return self.pairs[index]
+
+
+def dataset_index(path):
+    """The DatasetIndex of a .jsonl file, shared by every reader in this process until the file changes."""
+    index = _metadata.get(path)
+    if index is None or index.key != _file_key(path):
+        index = _metadata[path] = DatasetIndex(path)
+    return index
+
+
+def item_language(dataset, index):
+    """
+    "hi" or "en" for item `index` of a dataset: from the metadata index for a
+    JsonlDataset, else from the question's script.
+    """
+    if isinstance(dataset, JsonlDataset):
+        return dataset.language(index)
+    return "hi" if is_hindi(dataset[index]["question"]) else "en"
+
+
+class JsonlDataset:
+    """
+    Lazy, index-backed view of a .jsonl dataset.
+    Items are parsed only when accessed: iteration streams the file and
+    dataset[i] seeks straight to item i. Subsets (head, shard, sample) are
+    views over the same file and keep their original question indices.
+    """
+
+    def __init__(self, path, positions=None, offsets=None):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self._offsets = offsets if offsets is not None else load_offsets(path)
+        self.positions = positions  # Original indices in this view, None = every item
+        self._file = None
+        self._metadata = None
+
+    def __len__(self):
+        return len(self._offsets) if self.positions is None else len(self.positions)
+
+    def index_of(self, i):
+        """Original question index of the i-th item of this view."""
+        return i if self.positions is None else self.positions[i]
+
+    @property
+    def metadata(self):
+        """DatasetIndex of the whole file (built on first use); look items up with index_of(i)."""
+        if self._metadata is None:
+            self._metadata = dataset_index(self.path)
+        return self._metadata
+
+    def language(self, i):
+        """"hi" or "en" for the i-th item of this view, without reading it."""
+        return self.metadata.language(self.index_of(i))
+
+    def _read(self, original_index):
+        if self._file is None:
+            self._file = open(self.path, "rb")
+        self._file.seek(self._offsets[original_index])
+        return json.loads(self._file.readline())
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._view(range(len(self))[i])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"{self.name}: index {i} out of range")
+        return self._read(self.index_of(i))
+
+    def __iter__(self):
+        if self.positions is None:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            for original_index in self.positions:
+                yield self._read(original_index)
+
+    def _view(self, view_indices):
+        return JsonlDataset(self.path, [self.index_of(i) for i in view_indices], self._offsets)
+
+    def head(self, n):
+        """First n items."""
+        return self._view(range(min(n, len(self))))
+
+    def shard(self, num_shards, shard_index):
+        """Every num_shards-th item starting at shard_index."""
+        return self._view(range(shard_index, len(self), num_shards))
+
+    def sample(self, n, seed=0):
+        """Random sample of n items (kept in file order)."""
+        picked = random.Random(seed).sample(range(len(self)), min(n, len(self)))
+        return self._view(sorted(picked))
+
+    def stratified_sample(self, n, key=lambda item: item["label"].lower(), seed=0):
+        """Sample of about n items with each `key` stratum kept in proportion."""
+        strata = {}
+        for i, item in enumerate(self):
+            strata.setdefault(key(item), []).append(i)
+
+        rng = random.Random(seed)
+        picked = []
+        for members in strata.values():
+            share = min(len(members), round(n * len(members) / len(self)))
+            picked.extend(rng.sample(members, share))
+        return self._view(sorted(picked))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def open_dataset(dataset_name):
+    """Opens data/<dataset_name>.jsonl as a JsonlDataset."""
+    return JsonlDataset(os.path.join(DATASET_PATH, f"{dataset_name}.jsonl"))
+
+
+def open_index(dataset_name):
+    """DatasetIndex of data/<dataset_name>.jsonl, or None if the file is not there."""
+    path = os.path.join(DATASET_PATH, f"{dataset_name}.jsonl")
+    return dataset_index(path) if os.path.exists(path) else None
+
+
 def load_dataset(category=None):
     """
     Loads datasets based on a specific category.
     If no category is given, loads all datasets in a structured format.
+    Each dataset is a lazy JsonlDataset; items are read from disk on access.
     """
     datasets = {}
 
@@ -17,22 +309,17 @@ def load_dataset(category=None):
     if category:
         if category not in DATASET_CATEGORIES:
             raise ValueError(f"❌ Invalid category '{category}'. Available: {list(DATASET_CATEGORIES.keys())}")
+        categories = {category: DATASET_CATEGORIES[category]}
 
+    # If no category is provided, load all datasets
+    else:
+        categories = DATASET_CATEGORIES
+
+    for category, files in categories.items():
         datasets[category] = {}
-        for dataset_name in DATASET_CATEGORIES[category]:
+        for dataset_name in files:
             dataset_file = os.path.join(DATASET_PATH, f"{dataset_name}.jsonl")  # Ensure correct file path
             if os.path.exists(dataset_file):
-                with open(dataset_file, "r", encoding="utf-8") as f:
-                    datasets[category][dataset_name] = [json.loads(line) for line in f]
-
-    # If no category is provided, load all datasets
-    else:
-        for category, files in DATASET_CATEGORIES.items():
-            datasets[category] = {}
-            for dataset_name in files:
-                dataset_file = os.path.join(DATASET_PATH, f"{dataset_name}.jsonl")  # Ensure correct file path
-                if os.path.exists(dataset_file):
-                    with open(dataset_file, "r", encoding="utf-8") as f:
-                        datasets[category][dataset_name] = [json.loads(line) for line in f]
+                datasets[category][dataset_name] = JsonlDataset(dataset_file)
 
     return datasets
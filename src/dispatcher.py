@@ -0,0 +1,396 @@
+import time
+import random
+import asyncio
+from collections import deque, namedtuple
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from . import tracing
+
+# Backoff applied after a 429 / quota error (seconds)
+BACKOFF_BASE = 2
+BACKOFF_MAX = 60
+MAX_RATE_LIMIT_RETRIES = 6
+# Timeouts, 5xx and empty answers: retried after a fully jittered exponential backoff
+TRANSIENT_BACKOFF_BASE = 1
+MAX_TRANSIENT_RETRIES = 3
+# A request still running past this percentile of the provider's recent latencies
+# gets a duplicate ("hedge"); the first answer wins. At most HEDGE_MAX_FRACTION of
+# requests are hedged, and only once HEDGE_MIN_SAMPLES latencies have been seen.
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MAX_FRACTION = 0.05
+# After a batch, requests that failed with a retryable kind are dispatched again this many times
+REDISPATCH_PASSES = 1
+REDISPATCH_DELAY = 5
+
+ERROR_KINDS = ("rate_limited", "transient", "safety_blocked", "permanent")
+# Kind of the requests a dispatch did not send because the run's spending limit was reached
+BUDGET_EXHAUSTED = "over_budget"
+RETRYABLE_KINDS = ("rate_limited", "transient")
+TRANSIENT_STATUS_CODES = {408, 409, 425, 500, 502, 503, 504, 529}
+TRANSIENT_MESSAGES = ("timeout", "timed out", "temporarily", "unavailable", "connection", "deadline exceeded",
+                      "internal error", "bad gateway", "overloaded")
+SAFETY_MESSAGES = ("safety", "blocked", "content_filter", "content filter", "harm_category", "prohibited_content")
+
+# A request that failed for good: `kind` is one of ERROR_KINDS (or BUDGET_EXHAUSTED), `message` the last error
+Failure = namedtuple("Failure", ["kind", "message"])
+
+
+class SafetyBlocked(Exception):
+    """Raised by a query function when the provider refuses a prompt or answer on safety grounds."""
+
+
+class EmptyResponse(Exception):
+    """Raised by a query function when the provider returns no answer at all."""
+
+
+def estimate_tokens(text):
+    """
+    Rough token count used for TPM budgeting and run planning: ~4 UTF-8 bytes per
+    token, as byte-level BPE tokenizers see it. English costs ~4 characters per
+    token, Devanagari (3 bytes per character) about one token per 1.3 characters.
+    """
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def is_rate_limited(error):
+    """Returns True if an SDK exception looks like a 429 / quota error."""
+    for attr in ("status_code", "http_status", "code"):
+        if getattr(error, attr, None) == 429:
+            return True
+    message = str(error).lower()
+    return any(s in message for s in ("429", "rate limit", "quota", "resource exhausted", "resourceexhausted", "too many requests"))
+
+
+def classify_error(error):
+    """Sorts an SDK exception into one of ERROR_KINDS; unknown errors are permanent (not retried)."""
+    if is_rate_limited(error):
+        return "rate_limited"
+    if isinstance(error, SafetyBlocked):
+        return "safety_blocked"
+    if isinstance(error, (EmptyResponse, TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return "transient"
+
+    status = next((getattr(error, attr) for attr in ("status_code", "http_status", "code")
+                   if isinstance(getattr(error, attr, None), int)), None)
+    name = type(error).__name__.lower()
+    message = str(error).lower()
+    if "blocked" in name or "stopcandidate" in name or any(s in message for s in SAFETY_MESSAGES):
+        return "safety_blocked"
+    if status in TRANSIENT_STATUS_CODES or "timeout" in name:
+        return "transient"
+    if status is None and any(s in message for s in TRANSIENT_MESSAGES):
+        return "transient"
+    return "permanent"
+
+
+def jittered_backoff(attempt, base=TRANSIENT_BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2^attempt)] seconds."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `per_minute` units per minute."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.max_rate = per_minute / 60.0
+        self.rate = self.max_rate
+        self.capacity = capacity or max(1.0, per_minute / 6)  # ~10 seconds of burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def scale(self, factor):
+        """Multiplies the refill rate by `factor`, never above the configured rate."""
+        self._refill()
+        self.rate = max(self.max_rate / 64, min(self.max_rate, self.rate * factor))
+
+
+class ProviderBudget:
+    """Requests-per-minute, tokens-per-minute and concurrency budget for one provider.
+
+    The budget adapts to the provider: every 429 halves the request rate and pauses
+    all workers for an exponentially growing cooldown, every success slowly restores it.
+    """
+
+    def __init__(self, name, rpm, tpm, concurrency, output_tokens=256):
+        self.name = name
+        self.concurrency = concurrency
+        self.output_tokens = output_tokens
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cooldown_until = 0.0
+        self.backoff = BACKOFF_BASE
+        self.latencies = deque(maxlen=256)
+        self.completed = 0
+        self.hedged = 0
+
+    @classmethod
+    def from_config(cls, name, limits):
+        return cls(name, limits["rpm"], limits["tpm"], limits["concurrency"], limits.get("output_tokens", 256))
+
+    async def acquire(self, prompt):
+        """Waits until the provider has budget for `prompt`."""
+        while True:
+            wait = self.cooldown_until - time.monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimate_tokens(prompt) + self.output_tokens)
+
+    def on_success(self):
+        self.backoff = BACKOFF_BASE
+        self.requests.scale(1.05)
+
+    def observe(self, seconds):
+        self.latencies.append(seconds)
+        self.completed += 1
+
+    def hedge_delay(self):
+        """Seconds after which a running request should be hedged, or None if hedging is not allowed now."""
+        if len(self.latencies) < HEDGE_MIN_SAMPLES or self.hedged >= HEDGE_MAX_FRACTION * self.completed:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, len(ordered) * HEDGE_PERCENTILE // 100)]
+
+    def on_rate_limited(self):
+        if time.monotonic() < self.cooldown_until:
+            return  # Other in-flight requests hitting the same limit count as one backoff step
+        delay = self.backoff * (1 + random.random())
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+        self.backoff = min(BACKOFF_MAX, self.backoff * 2)
+        self.requests.scale(0.5)
+        print(f"[{self.name}] Rate limited, backing off {delay:.1f}s")
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class Progress:
+    """Completed-request counter with throughput-based ETA for one model."""
+
+    def __init__(self, name, total):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def update(self, count=1):
+        self.done += count
+        if self.done >= self.total:
+            self.finished = time.monotonic()
+
+    def __str__(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        if self.done >= self.total:
+            return f"{self.name}: {self.done}/{self.total} done in {format_duration(elapsed)}"
+        rate = self.done / elapsed if elapsed > 0 else 0
+        eta = format_duration((self.total - self.done) / rate) if rate > 0 else "?"
+        percent = self.done / self.total * 100 if self.total else 100
+        return f"{self.name}: {self.done}/{self.total} ({percent:.0f}%) ETA {eta}"
+
+
+async def report_progress(progress, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print("⏳ " + " | ".join(str(p) for p in progress.values()))
+
+
+def _consume(future):
+    """Retrieves a discarded future's exception so asyncio does not log it as unhandled."""
+    if not future.cancelled():
+        future.exception()
+
+
+async def first_success(futures):
+    """The first future to succeed; if all fail, raises the first failure."""
+    pending = set(futures)
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future
+                error = error or future.exception()
+        raise error
+    finally:
+        for future in pending:
+            future.add_done_callback(_consume)
+
+
+async def dispatch(prompts, query_fn, budget, progress=None, on_result=None, on_discard=None, reserve=None, release=None):
+    """Sends every prompt through the blocking `query_fn` as fast as `budget` allows.
+
+    Returns the responses in prompt order. Errors are classified (classify_error):
+    rate limits back the whole provider off, transient errors are retried with
+    jittered backoff, and requests running past the provider's latency percentile
+    are hedged. Requests that still fail are returned as Failure(kind, message).
+    `on_result(index, response)` is called as each response arrives, and
+    `on_discard(prompt, response)` for the answer of a losing hedge (it was still
+    paid for), whenever its thread finishes. Every call, hedges included, is
+    first cleared with `reserve(prompt)`: a prompt it refuses is not sent and
+    fails as BUDGET_EXHAUSTED, and a hedge it refuses is not sent. `release(prompt)`
+    gives a reservation back when its call ends without a response to charge
+    (a failure, or a losing hedge that failed or was cancelled).
+    Each request is traced as a "request" span with its queue wait (time spent
+    waiting for rate-limit budget), retries, hedges, status and response size.
+    """
+    results = [None] * len(prompts)
+    pending = iter(enumerate(prompts))
+
+    # Room for hedges and for losing requests that are still running in their threads.
+    # Not a `with` block: shutdown(wait=True) would block the shared event loop, and
+    # with it every other provider, until a losing hedge's thread returned.
+    executor = ThreadPoolExecutor(max_workers=budget.concurrency * 2)
+
+    def settle_loser(prompt, call):
+        # Runs in the losing call's thread, possibly after this dispatch returned
+        if not call.cancelled() and call.exception() is None and on_discard:
+            on_discard(prompt, call.result())
+        elif release:
+            release(prompt)
+
+    try:
+        async def request(prompt):
+            """One call, hedged with a duplicate if it runs past the latency percentile. Returns (result, hedged)."""
+            started = time.monotonic()
+            primary = executor.submit(query_fn, prompt)
+            waiting = asyncio.wrap_future(primary)
+            delay = budget.hedge_delay()
+            hedged = False
+            if delay is None:
+                result = await waiting
+            else:
+                done, _ = await asyncio.wait({waiting}, timeout=delay)
+                if done:
+                    result = waiting.result()
+                elif reserve and not reserve(prompt):
+                    result = await waiting  # No budget left to pay for a duplicate
+                else:
+                    hedged = True
+                    budget.hedged += 1
+                    await budget.acquire(prompt)
+                    calls = {waiting: primary}
+                    duplicate = executor.submit(query_fn, prompt)
+                    calls[asyncio.wrap_future(duplicate)] = duplicate
+                    try:
+                        winner = await first_success(calls)
+                    except Exception:
+                        if release:
+                            release(prompt)  # The duplicate's; the request keeps its own for a retry
+                        raise
+                    result = winner.result()
+                    for future, call in calls.items():
+                        if future is not winner:
+                            call.add_done_callback(partial(settle_loser, prompt))
+            budget.observe(time.monotonic() - started)
+            return result, hedged
+
+        async def worker():
+            for idx, prompt in pending:
+                if reserve and not reserve(prompt):
+                    results[idx] = Failure(BUDGET_EXHAUSTED, "run budget spent or reserved before this request was sent")
+                    if progress:
+                        progress.update()
+                    if on_result:
+                        on_result(idx, results[idx])
+                    continue
+                started = time.time_ns()
+                waited = 0.0
+                retries = {"rate_limited": 0, "transient": 0}
+                hedges = 0
+                status = "ok"
+                while True:
+                    wait_started = time.monotonic()
+                    await budget.acquire(prompt)
+                    waited += time.monotonic() - wait_started
+                    try:
+                        results[idx], hedged = await request(prompt)
+                        hedges += hedged
+                        status = "ok"
+                        budget.on_success()
+                        break
+                    except Exception as e:
+                        status = classify_error(e)
+                        if status == "rate_limited" and retries[status] < MAX_RATE_LIMIT_RETRIES:
+                            retries[status] += 1
+                            budget.on_rate_limited()
+                            continue
+                        if status == "transient" and retries[status] < MAX_TRANSIENT_RETRIES:
+                            retries[status] += 1
+                            await asyncio.sleep(jittered_backoff(retries[status]))
+                            continue
+                        print(f"[{budget.name}] API Error ({status}): {e}")
+                        results[idx] = Failure(status, str(e))
+                        if release:
+                            release(prompt)
+                        break
+                response = results[idx][0] if isinstance(results[idx], tuple) else results[idx]
+                tracing.add_span(
+                    "request", started, time.time_ns(),
+                    model=budget.name, prompt=tracing.prompt_key(prompt), status=status,
+                    retries=sum(retries.values()), hedges=hedges,
+                    queue_wait_ms=waited * 1000, prompt_tokens=estimate_tokens(prompt),
+                    response_chars=len(response) if status == "ok" else 0,
+                )
+                if progress:
+                    progress.update()
+                if on_result:
+                    on_result(idx, results[idx])
+
+        await asyncio.gather(*(worker() for _ in range(min(budget.concurrency, len(prompts)))))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+async def dispatch_all(streams, providers, report_every=10, on_result=None, on_discard=None, reserve=None,
+                       release=None):
+    """Runs every provider's prompt stream concurrently on one event loop.
+
+    `streams` maps a model name to its list of prompts and `providers` maps it to
+    {"query": fn, "limits": {...}}. Each provider is paced by its own budget, so
+    total wall time tracks the slowest provider rather than the sum of all of them.
+    `on_result(model_name, index, response)` is called as each response arrives;
+    `on_discard(model_name, prompt, response)`, `reserve(model_name, prompt)` and
+    `release(model_name, prompt)` work as in dispatch.
+    """
+    progress = {name: Progress(name, len(streams[name])) for name in providers}
+    reporter = asyncio.create_task(report_progress(progress, report_every))
+    try:
+        results = await asyncio.gather(*(
+            dispatch(
+                streams[name], provider["query"], ProviderBudget.from_config(name, provider["limits"]), progress[name],
+                on_result=partial(on_result, name) if on_result else None,
+                on_discard=partial(on_discard, name) if on_discard else None,
+                reserve=partial(reserve, name) if reserve else None,
+                release=partial(release, name) if release else None,
+            )
+            for name, provider in providers.items()
+        ))
+    finally:
+        reporter.cancel()
+
+    for p in progress.values():
+        print(f"✅ {p}")
+    return dict(zip(providers, results))
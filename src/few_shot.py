@@ -0,0 +1,115 @@
+import zlib
+import random
+from collections import OrderedDict
+from .dataset_loader import is_hindi, item_language
+
+POLICIES = ("first-k", "random", "nearest")
+FEATURE_DIM = 512  # Hashed character-trigram features for the nearest-neighbour index
+NEAREST_CANDIDATES = 1024  # Exemplars are drawn from at most this many items
+MAX_POOLS = 32
+
+
+def format_exemplar(example, language=None):
+    hindi = is_hindi(example["question"]) if language is None else language == "hi"
+    instruction = "उत्तर:" if hindi else "Answer:"
+    return (
+        f"Q: {example['question']}\nOptions:\n" +
+        "\n".join(example["options"]) +
+        f"\n{instruction} {example['label']}"
+    )
+
+
+def lexical_vectors(texts):
+    """L2-normalised hashed character-trigram count vectors, one row per text."""
+    import numpy as np
+
+    vectors = np.zeros((len(texts), FEATURE_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        text = " ".join(text.lower().split())
+        for i in range(len(text) - 2):
+            vectors[row, zlib.crc32(text[i:i + 3].encode("utf-8")) % FEATURE_DIM] += 1
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-9)
+
+
+class ExemplarPool:
+    """
+    Few-shot exemplars for one dataset, formatted once and reused.
+    policy="first-k" takes the first k items, "random" a fixed seeded set and
+    "nearest" the k most lexically similar items to each question; the current
+    question is never used as its own exemplar.
+    """
+
+    def __init__(self, dataset, k=3, policy="first-k", seed=0):
+        if policy not in POLICIES:
+            raise ValueError(f"❌ Invalid few-shot policy '{policy}'. Available: {list(POLICIES)}")
+        self.dataset = dataset
+        self.k = k
+        self.policy = policy
+        self._rendered = {}
+        self._blocks = {}
+        self._neighbours = None
+
+        n = len(dataset)
+        if policy == "first-k":
+            self._candidates = list(range(min(k + 1, n)))
+        elif policy == "random":
+            self._candidates = random.Random(seed).sample(range(n), min(k + 1, n))
+        else:
+            self._candidates = list(range(min(NEAREST_CANDIDATES, n)))
+
+    def _build_neighbours(self):
+        """Top-(k+1) candidate exemplars for every question, in one batched pass."""
+        import numpy as np
+
+        questions = lexical_vectors([item["question"] for item in self.dataset])
+        candidates = questions[self._candidates]
+        width = min(self.k + 1, len(self._candidates))
+        neighbours = np.empty((len(questions), width), dtype=np.int64)
+
+        for start in range(0, len(questions), 1024):
+            scores = questions[start:start + 1024] @ candidates.T
+            top = np.argpartition(-scores, width - 1, axis=1)[:, :width]
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+            neighbours[start:start + 1024] = np.take_along_axis(top, order, axis=1)
+
+        self._neighbours = np.asarray(self._candidates)[neighbours]
+
+    def select(self, current_index):
+        """Indices of the k exemplars for the question at current_index."""
+        if self.policy == "nearest":
+            if self._neighbours is None:
+                self._build_neighbours()
+            candidates = self._neighbours[current_index].tolist()
+        else:
+            candidates = self._candidates
+        return tuple(i for i in candidates if i != current_index)[:self.k]
+
+    def render(self, index):
+        if index not in self._rendered:
+            self._rendered[index] = format_exemplar(self.dataset[index], item_language(self.dataset, index))
+        return self._rendered[index]
+
+    def block(self, current_index):
+        """Formatted exemplar block for the question at current_index."""
+        selected = self.select(current_index)
+        if selected not in self._blocks:
+            self._blocks[selected] = "\n\n".join(self.render(i) for i in selected)
+        return self._blocks[selected]
+
+
+_pools = OrderedDict()
+
+
+def get_exemplar_pool(dataset, k=3, policy="first-k", seed=0):
+    """Returns the cached ExemplarPool for (dataset, k, policy, seed)."""
+    key = (id(dataset), k, policy, seed)
+    if key in _pools:
+        _pools.move_to_end(key)
+        return _pools[key]
+
+    pool = ExemplarPool(dataset, k, policy, seed)
+    _pools[key] = pool  # The pool holds a reference to dataset, so its id stays valid
+    if len(_pools) > MAX_POOLS:
+        _pools.popitem(last=False)
+    return pool
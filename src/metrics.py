@@ -0,0 +1,183 @@
+import numpy as np
+from .config import BOOTSTRAP_RESAMPLES, CONFIDENCE
+from .dataset_loader import english_counterpart
+
+LABELS = ["a", "b", "c", "d", "e"]
+INVALID = len(LABELS)  # Code for predictions that are not an option label (extraction failures)
+_LABEL_CODES = {label: code for code, label in enumerate(LABELS)}
+BOOTSTRAP_CELLS = 10_000_000  # Max resample matrix size (resamples x items) per batch
+
+
+def encode_labels(values):
+    """Maps labels to codes 0-4 (a-e), anything else (None, "N/A", ...) to INVALID."""
+    return np.fromiter(
+        (_LABEL_CODES.get(v.strip().lower(), INVALID) if isinstance(v, str) else INVALID for v in values),
+        dtype=np.int8, count=len(values),
+    )
+
+
+def dataset_language(dataset_name):
+    return "hi" if "hindi" in dataset_name.split("_") else "en"
+
+
+def item_languages(metrics, dataset_name, codes=None):
+    """
+    Language ("hi" or "en") of each scored item of a partition (label_metrics()
+    output plus its "index" array). `codes` are the dataset's per-item language
+    codes from its metadata index (DatasetIndex.languages); without them, or if
+    the partition indexes past them, every item gets dataset_language().
+    """
+    index = metrics["index"]
+    if codes is None or (len(index) and index.max() >= len(codes)):
+        return np.full(len(index), dataset_language(dataset_name))
+    return np.where(np.frombuffer(codes.encode("ascii"), dtype="S1")[index] == b"h", "hi", "en")
+
+
+def _bootstrap_means(correct, resamples, seed, paired_with=None):
+    """Means of `resamples` bootstrap resamples, generated in batched index matrices."""
+    rng = np.random.default_rng(seed)
+    n = len(correct)
+    batch = max(1, BOOTSTRAP_CELLS // max(n, 1))
+    means = np.empty(resamples)
+    for start in range(0, resamples, batch):
+        size = min(batch, resamples - start)
+        idx = rng.integers(0, n, size=(size, n))
+        sample = correct[idx] if paired_with is None else correct[idx] - paired_with[idx]
+        means[start:start + size] = sample.mean(axis=1)
+    return means
+
+
+def bootstrap_ci(correct, resamples=BOOTSTRAP_RESAMPLES, confidence=CONFIDENCE, seed=0):
+    """Percentile bootstrap confidence interval of the mean of a 0/1 array."""
+    if len(correct) == 0:
+        return 0.0, 0.0
+    means = _bootstrap_means(np.asarray(correct, dtype=np.float32), resamples, seed)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(means, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def paired_delta(first, second, resamples=BOOTSTRAP_RESAMPLES, confidence=CONFIDENCE, seed=0):
+    """Mean of second - first over paired items, with a paired bootstrap interval."""
+    first = np.asarray(first, dtype=np.float32)
+    second = np.asarray(second, dtype=np.float32)
+    if len(first) == 0:
+        return 0.0, 0.0, 0.0
+    means = _bootstrap_means(second, resamples, seed, paired_with=first)
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(means, [tail, 100 - tail])
+    return float((second - first).mean()), float(low), float(high)
+
+
+def label_metrics(predicted, correct_answer):
+    """
+    Accuracy, per-option confusion matrix and extraction-failure rate for one partition.
+    Rows of the confusion matrix are true labels a-e, columns are predicted labels
+    a-e plus an "invalid" column for responses with no extractable option.
+    """
+    true = encode_labels(correct_answer)
+    pred = encode_labels(predicted)
+    correct = (pred == true) & (true != INVALID)
+    n = len(true)
+
+    confusion = np.bincount(true.astype(np.int64) * (INVALID + 1) + pred, minlength=(INVALID + 1) ** 2)
+    confusion = confusion.reshape(INVALID + 1, INVALID + 1)[:INVALID]
+
+    # Macro precision / recall over the options that occur as a true or predicted label
+    tp = np.diag(confusion[:, :INVALID]).astype(np.float64)
+    predicted_totals = confusion[:, :INVALID].sum(axis=0)
+    true_totals = confusion.sum(axis=1)
+    present = (predicted_totals + true_totals) > 0
+    precision = np.divide(tp, predicted_totals, out=np.zeros_like(tp), where=predicted_totals > 0)
+    recall = np.divide(tp, true_totals, out=np.zeros_like(tp), where=true_totals > 0)
+
+    low, high = bootstrap_ci(correct)
+    return {
+        "n": n,
+        "correct": correct,
+        "accuracy": correct.mean() * 100 if n else 0.0,
+        "ci_low": low * 100,
+        "ci_high": high * 100,
+        "macro_precision": precision[present].mean() * 100 if present.any() else 0.0,
+        "macro_recall": recall[present].mean() * 100 if present.any() else 0.0,
+        "failure_rate": (pred == INVALID).mean() * 100 if n else 0.0,
+        "confusion": confusion,
+    }
+
+
+def _run(key, inputs, compute, memo):
+    return memo(key, inputs, compute) if memo else compute()
+
+
+def language_metrics(partition_metrics, memo=None, fingerprints=None, languages=None):
+    """
+    Accuracy per (model, strategy, language), pooling every item of that language.
+    `partition_metrics` maps (model, strategy, dataset) to label_metrics() output
+    (plus an "index" array). `languages` maps a dataset to (per-item language codes;
+    fingerprint of them) from the dataset metadata index (DatasetIndex.languages),
+    so a Hindi item counts as Hindi whatever its file is called; datasets without
+    one are pooled by name (see item_languages). When `memo` (MetricsCache.memo)
+    and the partitions' `fingerprints` are given, groups whose partitions are
+    unchanged are not recomputed.
+    """
+    languages = languages or {}
+    per_item, pooled = {}, {}
+    for key, metrics in partition_metrics.items():
+        model, strategy, dataset = key
+        per_item[key] = item_languages(metrics, dataset, languages.get(dataset, (None, None))[0])
+        # A partition without scored items still joins the pool of its name's language, with n = 0
+        for language in np.unique(per_item[key]) if len(per_item[key]) else [dataset_language(dataset)]:
+            pooled.setdefault((model, strategy, str(language)), []).append(key)
+
+    summary = {}
+    for key, members in pooled.items():
+        def compute(members=members, language=key[2]):
+            correct = np.concatenate([partition_metrics[m]["correct"][per_item[m] == language] for m in members])
+            n = len(correct)  # 0 when every request of the pool failed
+            low, high = bootstrap_ci(correct)
+            return {"n": n, "accuracy": correct.mean() * 100 if n else 0.0, "ci_low": low * 100, "ci_high": high * 100}
+
+        inputs = [[fingerprints[m], languages.get(m[2], (None, None))[1]] for m in members] if fingerprints else None
+        summary[key] = _run(["language", *key], inputs, compute, memo)
+    return summary
+
+
+def paired_language_deltas(partition_metrics, memo=None, fingerprints=None, pairs=None):
+    """
+    Hindi minus English accuracy for each parallel dataset pair (e.g. neet_physics
+    and neet_hindi_physics), matched item by item on the partitions' "index" arrays.
+    `pairs` maps a Hindi dataset to (English index of each of its items, -1 if
+    unpaired; fingerprint of that pairing), from the dataset metadata index
+    (DatasetIndex.pairs); without it Hindi item i is matched to English item i.
+    `memo` and `fingerprints` work as in language_metrics.
+    """
+    pairs = pairs or {}
+    deltas = {}
+    for hindi_key in partition_metrics:
+        model, strategy, dataset = hindi_key
+        english_name = english_counterpart(dataset)
+        english_key = (model, strategy, english_name)
+        if english_name is None or english_key not in partition_metrics:
+            continue
+
+        pairing, pairing_fingerprint = pairs.get(dataset, (None, None))
+
+        def compute(english_key=english_key, hindi_key=hindi_key, pairing=pairing):
+            english, hindi = partition_metrics[english_key], partition_metrics[hindi_key]
+            english_of = hindi["index"] if pairing is None else np.asarray(pairing, dtype=np.int64)[hindi["index"]]
+            common, en_pos, hi_pos = np.intersect1d(english["index"], english_of, return_indices=True)
+            en = english["correct"][en_pos]
+            hi = hindi["correct"][hi_pos]
+            delta, low, high = paired_delta(en, hi)
+            return {
+                "pairs": len(common),
+                "english_accuracy": en.mean() * 100 if len(common) else 0.0,
+                "hindi_accuracy": hi.mean() * 100 if len(common) else 0.0,
+                "delta": delta * 100,
+                "ci_low": low * 100,
+                "ci_high": high * 100,
+            }
+
+        inputs = [fingerprints[english_key], fingerprints[hindi_key], pairing_fingerprint] if fingerprints else None
+        deltas[(model, strategy, english_name, dataset)] = _run(["delta", *english_key, dataset], inputs, compute, memo)
+    return deltas
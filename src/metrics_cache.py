@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+import numpy as np
+from .config import METRICS_CACHE_PATH, BOOTSTRAP_RESAMPLES, CONFIDENCE
+
+
+def partition_fingerprint(path):
+    """Fingerprint of a result partition: its location plus (name, size, mtime) of every part file."""
+    parts = []
+    for name in sorted(os.listdir(path)):
+        stat = os.stat(os.path.join(path, name))
+        parts.append([name, stat.st_size, stat.st_mtime_ns])
+    return [os.path.normpath(path), parts]
+
+
+class MetricsCache:
+    """
+    Computed metric summaries, each stored with the fingerprint of its inputs.
+    Scalars live in index.json and arrays in one .npz file per summary, so
+    unchanged result partitions are never re-read or re-bootstrapped.
+    """
+
+    def __init__(self, path=METRICS_CACHE_PATH):
+        self.path = path
+        self.index_path = os.path.join(path, "index.json")
+        os.makedirs(path, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        self.touched = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _array_file(self, name):
+        return os.path.join(self.path, hashlib.sha1(name.encode("utf-8")).hexdigest()[:16] + ".npz")
+
+    @staticmethod
+    def _fingerprint(inputs):
+        # Bootstrap settings are part of every fingerprint so changing them invalidates the cache
+        return hashlib.sha256(json.dumps([inputs, BOOTSTRAP_RESAMPLES, CONFIDENCE]).encode("utf-8")).hexdigest()
+
+    def fresh(self, key, inputs):
+        """True if the summary stored for `key` was computed from these `inputs`."""
+        entry = self.index.get(json.dumps(key))
+        return bool(entry) and entry["fingerprint"] == self._fingerprint(inputs)
+
+    def memo(self, key, inputs, compute):
+        """Returns the stored summary for `key` if `inputs` are unchanged, else compute() and store it."""
+        name = json.dumps(key)
+        fingerprint = self._fingerprint(inputs)
+        self.touched.add(name)
+
+        entry = self.index.get(name)
+        if entry and entry["fingerprint"] == fingerprint:
+            summary = dict(entry["scalars"])
+            if entry["arrays"]:
+                with np.load(self._array_file(name)) as arrays:
+                    summary.update({k: arrays[k] for k in entry["arrays"]})
+            self.hits += 1
+            return summary
+
+        summary = compute()
+        arrays = {k: v for k, v in summary.items() if isinstance(v, np.ndarray)}
+        scalars = {k: (v.item() if isinstance(v, np.generic) else v) for k, v in summary.items() if k not in arrays}
+        if arrays:
+            np.savez(self._array_file(name), **arrays)
+        self.index[name] = {"fingerprint": fingerprint, "scalars": scalars, "arrays": sorted(arrays)}
+        self.misses += 1
+        return summary
+
+    def save(self):
+        """Writes the index, dropping summaries that were not used by this aggregation."""
+        for name in set(self.index) - self.touched:
+            array_file = self._array_file(name)
+            if os.path.exists(array_file):
+                os.remove(array_file)
+            del self.index[name]
+
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
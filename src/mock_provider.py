@@ -0,0 +1,103 @@
+import math
+import time
+import random
+import threading
+
+LABELS = "abcd"
+DEFAULT_TEMPLATES = [
+    "The answer is ({label})",
+    "Answer: {label}",
+    "Let me think step by step.\nThe correct option is {label}.\nAnswer: ({label})",
+    "उत्तर: ({label})",
+]
+
+
+class MockAPIError(Exception):
+    """Transient failure raised by a MockProvider."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MockProvider:
+    """
+    Offline stand-in for a model API, usable anywhere a query function is expected.
+
+    latency: "constant", "uniform" (0 to 2 x mean) or "lognormal" (mean with `sigma` spread), in seconds.
+    error_rate: probability of a transient MockAPIError (status 503) per call.
+    burst_every / burst_length: every `burst_every` seconds, all calls during the next
+        `burst_length` seconds fail with a 429 like a provider-side quota wall.
+    answers: "templated" fills a random template with a random label, or pass a list of
+        canned responses to cycle through.
+    """
+
+    def __init__(self, latency="lognormal", mean_latency=0.2, sigma=0.5, error_rate=0.0,
+                 burst_every=0, burst_length=0, answers="templated", templates=None, seed=0):
+        self.latency = latency
+        self.mean_latency = mean_latency
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.answers = answers
+        self.templates = templates or DEFAULT_TEMPLATES
+        self.started = time.monotonic()
+        self.calls = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sample_latency(self):
+        if self.mean_latency <= 0:
+            return 0.0
+        if self.latency == "constant":
+            return self.mean_latency
+        if self.latency == "uniform":
+            return self._rng.uniform(0, 2 * self.mean_latency)
+        # Lognormal with the requested mean: mu = ln(mean) - sigma^2 / 2
+        return self._rng.lognormvariate(math.log(self.mean_latency) - self.sigma ** 2 / 2, self.sigma)
+
+    def __call__(self, prompt, params=None):  # Generation `params` are accepted and ignored
+        with self._lock:
+            self.calls += 1
+            delay = self._sample_latency()
+            fail = self._rng.random() < self.error_rate
+            call = self.calls
+            label = self._rng.choice(LABELS)
+            template = self._rng.choice(self.templates)
+
+        elapsed = time.monotonic() - self.started
+        if self.burst_every and elapsed % self.burst_every < self.burst_length:
+            with self._lock:
+                self.rate_limited += 1
+            raise MockAPIError("429 Too Many Requests (mock quota burst)", status_code=429)
+
+        if delay:
+            time.sleep(delay)
+        if fail:
+            with self._lock:
+                self.errors += 1
+            raise MockAPIError("503 Service Unavailable (mock)", status_code=503)
+
+        if self.answers == "templated":
+            return template.format(label=label)
+        return self.answers[(call - 1) % len(self.answers)]
+
+
+def register_mock_providers(count=2, limits=None, **provider_options):
+    """
+    Replaces the model registry with `count` MockProviders named mock-1, mock-2, ...
+    Returns {name: MockProvider} so callers can inspect call and error counters.
+    """
+    from .model_api import PROVIDERS, register_provider
+
+    limits = limits or {"rpm": 10 ** 9, "tpm": 10 ** 12, "concurrency": 64}
+    PROVIDERS.clear()
+    providers = {}
+    for i in range(1, count + 1):
+        name = f"mock-{i}"
+        providers[name] = MockProvider(seed=i, **provider_options)
+        register_provider(name, providers[name], limits=limits, model_id=name)
+    return providers
@@ -1,113 +1,255 @@
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import together
-import google.generativeai as genai
-from .config import TOGETHER_API_KEY, GEMINI_API_KEY
-
-# API Clients
-client = together.Together(api_key=TOGETHER_API_KEY)
-genai.configure(api_key=GEMINI_API_KEY)
+import asyncio
+from .config import TOGETHER_API_KEY, GEMINI_API_KEY, PROVIDER_LIMITS, PROVIDER_PRICING
+from .dispatcher import (
+    dispatch_all, estimate_tokens, Failure, SafetyBlocked, EmptyResponse, RETRYABLE_KINDS,
+    REDISPATCH_PASSES, REDISPATCH_DELAY,
+)
+from .prompt_plan import PromptPlan
+from .response_cache import cache_key
+from . import tracing
+
+# API Clients (SDKs are imported and clients created on first use, so importing
+# this module needs neither the provider SDKs' import time nor API keys)
+_clients = {}
+
+def get_together_client():
+    if "together" not in _clients:
+        import together
+        _clients["together"] = together.Together(api_key=TOGETHER_API_KEY)
+    return _clients["together"]
+
+def get_gemini_model():
+    if "gemini" not in _clients:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        _clients["gemini"] = genai.GenerativeModel(GEMINI_MODEL)
+    return _clients["gemini"]
 
 # Models
 TOGETHER_MODEL = "meta-llama/Llama-3.3-70B-Instruct-Turbo"
 GEMINI_MODEL = "gemini-2.0-flash"
 
-# Config
-MAX_WORKERS = 20  # Threads for parallel execution
-GEMINI_SLEEP_TIME = 5  # Sleep between requests (optional, adjust as needed)
-TOGETHER_SLEEP_TIME = 2
-
-# Query Gemini API
-def query_gemini(prompt):
-    try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        response = model.generate_content(prompt)
-        
-        # Extract the response content safely
-        if response and response.candidates:
-            return response.candidates[0].content.parts[0].text.strip()
-        else:
-            return "No response"
-    except Exception as e:
-        print(f"[Gemini] API Error: {e}")
-        return "N/A"
+# Finish reasons Gemini uses when it withholds an answer
+GEMINI_BLOCK_REASONS = {"SAFETY", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII"}
+
+# Query Gemini API (errors are raised so the dispatcher can classify and retry them)
+def query_gemini(prompt, params=None):
+    response = get_gemini_model().generate_content(prompt, generation_config=params or None)
+
+    # Extract the response content safely; blocked and empty answers are errors, not answers
+    if not response or not response.candidates:
+        feedback = getattr(response, "prompt_feedback", None)
+        if feedback is not None and feedback.block_reason:
+            raise SafetyBlocked(f"Prompt blocked: {feedback.block_reason}")
+        raise EmptyResponse("Gemini returned no candidates")
+    candidate = response.candidates[0]
+    if not candidate.content.parts:
+        reason = getattr(candidate.finish_reason, "name", str(candidate.finish_reason))
+        if reason in GEMINI_BLOCK_REASONS:
+            raise SafetyBlocked(f"Answer blocked: {reason}")
+        raise EmptyResponse(f"Gemini returned an empty answer ({reason})")
+    text = candidate.content.parts[0].text.strip()
+
+    # Reported token usage calibrates the run planner's estimates
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return text
+    return text, {"input_tokens": usage.prompt_token_count, "output_tokens": usage.candidates_token_count}
 
 # Query Together AI API
-def query_together(prompt):
-    try:
-        response = client.chat.completions.create(
-            model=TOGETHER_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-        )
-        return response.choices[0].message.content.strip() if response.choices else "No response"
-    except Exception as e:
-        print(f"[Together AI] API Error: {e}")
-        return "N/A"
-
-# Generic Multi-thread Runner
-# def run_multithread(prompts, query_fn, sleep_time=0):
-#     results = []
-#     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-#         futures = []
-
-#         for idx, prompt in enumerate(prompts):
-#             prompt_with_id = f"Q{idx+1}:\n{prompt}"  # Add index prefix for tracking
-#             futures.append(executor.submit(query_fn, prompt_with_id))
-#             if sleep_time > 0:
-#                 time.sleep(sleep_time)  # Avoid rate limits
-
-#         for future in as_completed(futures):
-#             results.append(future.result())
-
-#     return results
-
-# def run_multithread(prompts, query_fn, sleep_time=0):
-#     results = [None] * len(prompts)
-#     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-#         futures = {}
-#         for idx, prompt in enumerate(prompts):
-#             prompt_with_id = f"Q{idx+1}:\n{prompt}"
-#             future = executor.submit(query_fn, prompt_with_id)
-#             futures[future] = idx
-#             if sleep_time > 0:
-#                 time.sleep(sleep_time)
-
-#         for future in as_completed(futures):
-#             idx = futures[future]
-#             results[idx] = future.result()
-
-#     return results
-
-def run_multithread(prompts, query_fn, sleep_time=0):
-    results = [None] * len(prompts)
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {}
-        for idx, prompt in enumerate(prompts):
-            future = executor.submit(query_fn, prompt)
-            futures[future] = idx
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-
-        for future in as_completed(futures):
-            idx = futures[future]
-            results[idx] = future.result()
-
-    return results
+def query_together(prompt, params=None):
+    response = get_together_client().chat.completions.create(
+        model=TOGETHER_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        **(params or {}),
+    )
+    if not response.choices:
+        raise EmptyResponse("Together returned no choices")
+    if response.choices[0].finish_reason == "content_filter":
+        raise SafetyBlocked("Answer blocked: content_filter")
+    text = response.choices[0].message.content.strip()
+    if response.usage is None:
+        return text
+    return text, {"input_tokens": response.usage.prompt_tokens, "output_tokens": response.usage.completion_tokens}
+
+# Provider Registry: model name -> query function, dispatch budget and cache identity
+PROVIDERS = {}
+
+def register_provider(name, query_fn, limits=None, model_id=None, params=None, pricing=None):
+    """Registers a model so batch_query runs it alongside the others.
+
+    `query_fn` takes a prompt (and optionally `params`, generation settings such as
+    {"temperature": 0.7}) and returns the response text, or (text, {"input_tokens",
+    "output_tokens"}) when the API reports usage. It raises on API errors, SafetyBlocked
+    for refusals and EmptyResponse for missing answers (see classify_error).
+    `limits` defaults to PROVIDER_LIMITS[name] and `pricing` (USD per 1M input and
+    output tokens) to PROVIDER_PRICING[name]. `model_id` and `params` (generation
+    settings) are part of the response cache key.
+    """
+    PROVIDERS[name] = {
+        "query": query_fn,
+        "limits": limits or PROVIDER_LIMITS[name],
+        "model_id": model_id or name,
+        "params": params or {},
+        "pricing": pricing or PROVIDER_PRICING.get(name, {}),
+    }
 
+register_provider("gemini", query_gemini, model_id=GEMINI_MODEL)
+register_provider("together", query_together, model_id=TOGETHER_MODEL)
+
+def assigned_positions(plan, assignments, name):
+    """Unique-prompt positions of `plan` that model `name` should answer (all without `assignments`)."""
+    if assignments is None:
+        return range(len(plan.prompts))
+    return sorted({plan.positions[i] for i in assignments[name]})
+
+
+def pending_prompts(prompts, models=None, cache=None, journal=None, assignments=None):
+    """
+    What batch_query would send: {model_name: [index into prompts, ...]} with one
+    index per unique prompt not yet answered in `journal` or `cache`.
+    """
+    plan = PromptPlan(prompts)
+    first = {}
+    for i, position in enumerate(plan.positions):
+        first.setdefault(position, i)
+
+    pending = {}
+    for name in models or PROVIDERS:
+        provider = PROVIDERS[name]
+        todo = [u for u in assigned_positions(plan, assignments, name)
+                if not (journal and journal.contains(name, plan.prompts[u]))]
+        if cache is not None:
+            keys = {u: cache_key(provider["model_id"], provider["params"], plan.prompts[u]) for u in todo}
+            stored = cache.contains_many(list(keys.values()))
+            todo = [u for u in todo if keys[u] not in stored]
+        pending[name] = [first[u] for u in todo]
+    return pending
 
 # Benchmark Execution
-def batch_query(prompts):
-    print(f"Total Prompts: {len(prompts)} | Max Threads: {MAX_WORKERS}\n")
-
-    print("Running with Gemini...\n")
-    all_gemini_results = run_multithread(prompts, query_gemini, sleep_time=GEMINI_SLEEP_TIME)
-
-    print("Gemini Done!\nRunning with Together AI...\n")
-    all_together_results = run_multithread(prompts, query_together, sleep_time=TOGETHER_SLEEP_TIME)
+def batch_query(prompts, models=None, cache=None, journal=None, savings=None, planner=None, labels=None,
+                assignments=None, strategies=None):
+    """Queries every registered model (or only `models`) concurrently.
+
+    Prompts are normalised and deduplicated first (see PromptPlan), then
+    prompts already answered in `journal` (the RunJournal of this run, which
+    also replays a resumed run) or in `cache` (a ResponseCache) are not re-sent,
+    and every new response is appended to `journal` as soon as it arrives.
+    Calls and prompt tokens avoided are added to the `savings` Counter if given,
+    and token usage of every new response is recorded with `planner` (a RunPlanner),
+    including answers of losing hedges. Under a spending limit every call reserves
+    its estimated cost with the planner before it is sent (`strategies`, aligned
+    with `prompts`, size the expected answers); once spend and reservations reach
+    the limit, prompts not yet sent fail as BUDGET_EXHAUSTED instead.
+    `labels` (tracking ids aligned with `prompts`) name the prompts in the trace.
+    `assignments` ({model_name: [index into prompts, ...]}, see sharding.py)
+    limits each model to those prompts; the others are left as None.
+    Requests failing with a retryable error (rate limit, transient) are
+    re-dispatched REDISPATCH_PASSES more times once the batch is done.
+    Returns {model_name: [response, ...]} with responses aligned to `prompts`;
+    requests that still failed are Failure(kind, message) entries.
+    """
+    providers = {name: PROVIDERS[name] for name in (models or PROVIDERS)}
+    with tracing.span("plan", prompts=len(prompts)) as span:
+        plan = PromptPlan(prompts)
+        span["unique"] = len(plan.prompts)
+    unique = plan.prompts
+    if labels:
+        tracing.label_prompts([unique[position] for position in plan.positions], labels)
+    print(f"Total Prompts: {len(prompts)} | Models: {', '.join(providers)}")
+    print(f"🧩 Prompt plan: {plan.summary()}\n")
+
+    # Split each model's prompts into already-answered ones and prompts still to send
+    results, keys, to_send = {}, {}, {}
+    with tracing.span("lookup", prompts=len(unique)):
+        for name, provider in providers.items():
+            wanted = assigned_positions(plan, assignments, name)
+            results[name] = [None] * len(unique)
+            for i in wanted:
+                results[name][i] = journal.lookup(name, unique[i]) if journal else None
+            pending = [i for i in wanted if results[name][i] is None]
+            if journal:
+                print(f"{name}: {len(wanted) - len(pending)} already answered in run journal")
+
+            if cache is not None:
+                keys[name] = {i: cache_key(provider["model_id"], provider["params"], unique[i]) for i in pending}
+                cached = cache.get_many(list(keys[name].values()))
+                for i in pending:
+                    results[name][i] = cached.get(keys[name][i])
+                pending = [i for i in pending if results[name][i] is None]
+                print(f"{name}: {len(cached)} cached, {len(pending)} to query")
+            to_send[name] = pending
+
+            if savings is not None:
+                reused = set(wanted) - set(pending)
+                savings["duplicate_calls"] += plan.duplicates
+                savings["duplicate_tokens"] += plan.duplicate_tokens
+                savings["reused_calls"] += len(reused)
+                savings["reused_tokens"] += sum(estimate_tokens(unique[i]) for i in reused)
+                savings["prefix_tokens"] += plan.prefix_tokens
+
+    def collector(batch):
+        def on_result(name, position, response):
+            i = batch[name][position]
+            if isinstance(response, Failure):
+                results[name][i] = response
+                return
+            response, usage = response if isinstance(response, tuple) else (response, None)
+            results[name][i] = response
+            if journal:
+                journal.record(name, unique[i], response)
+            if planner:
+                planner.record(name, unique[i], response, usage)
+        return on_result
+
+    def on_discard(name, prompt, response):
+        response, usage = response if isinstance(response, tuple) else (response, None)
+        planner.record(name, prompt, response, usage)
+
+    reserve = release = None
+    if planner is not None and planner.limit is not None:
+        strategy_of = {}
+        for position, strategy in zip(plan.positions, strategies or []):
+            strategy_of.setdefault(unique[position], strategy)
+
+        def reserve(name, prompt):
+            return planner.reserve(name, prompt, strategy_of.get(prompt))
+        release = planner.release
+
+    # Pending prompts keep the plan's sorted order, so shared prefixes are dispatched back to back.
+    # Later passes only re-send what failed with a retryable error.
+    batch = to_send
+    for attempt in range(REDISPATCH_PASSES + 1):
+        if attempt:
+            print(f"🔁 Re-dispatching {sum(map(len, batch.values()))} failed requests in {REDISPATCH_DELAY}s")
+            time.sleep(REDISPATCH_DELAY)
+        streams = {name: [unique[i] for i in batch[name]] for name in providers}
+        with tracing.span("dispatch", attempt=attempt, requests=sum(len(stream) for stream in streams.values())):
+            asyncio.run(dispatch_all(
+                streams, providers, on_result=collector(batch), on_discard=on_discard if planner else None,
+                reserve=reserve, release=release,
+            ))
+        batch = {
+            name: [i for i in batch[name] if isinstance(results[name][i], Failure) and results[name][i].kind in RETRYABLE_KINDS]
+            for name in providers
+        }
+        if not any(batch.values()):
+            break
+
+    for name in providers:
+        failed = sum(1 for i in to_send[name] if isinstance(results[name][i], Failure))
+        if failed:
+            print(f"⚠️ {name}: {failed} requests failed; they are stored as failed and re-sent by `run --resume`")
+
+    if cache is not None:
+        # Failed requests are not cached so the next run retries them
+        with tracing.span("cache_write"):
+            for name, provider in providers.items():
+                cache.put_many(
+                    provider["model_id"],
+                    [(keys[name][i], results[name][i]) for i in to_send[name] if not isinstance(results[name][i], Failure)],
+                )
 
     print("Benchmark Completed!\n")
-
-    return {
-        "gemini": all_gemini_results,
-        "together": all_together_results
-    }
+    return {name: plan.expand(responses) for name, responses in results.items()}
@@ -0,0 +1,248 @@
+import io
+import os
+import json
+import time
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import contextlib
+import numpy as np
+
+STAGES = ["build", "dispatch", "cache", "extract", "metrics"]
+# Import-time budget (seconds) for each run_benchmark.py subcommand
+IMPORT_BUDGETS = {"run": 3.0, "metrics": 1.0, "dry-run": 0.5, "export": 1.0, "trace": 0.5, "merge": 1.0, "sweep": 3.0}
+STRATEGIES = ["zero-shot", "few-shot", "cot"]
+WORDS = ["force", "energy", "mass", "velocity", "cell", "enzyme", "acid", "constitution", "river", "argument",
+         "assumption", "conclusion", "reaction", "molecule", "charge", "wave", "policy", "parliament"]
+HINDI_WORDS = ["बल", "ऊर्जा", "द्रव्यमान", "वेग", "कोशिका", "अम्ल", "संविधान", "नदी", "तर्क", "निष्कर्ष"]
+
+
+def synthetic_dataset(path, n, hindi_fraction=0.3, seed=0):
+    """Writes n random multiple-choice items in the data/*.jsonl format."""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(n):
+            words = HINDI_WORDS if rng.random() < hindi_fraction else WORDS
+            question = " ".join(rng.choice(words) for _ in range(rng.randint(8, 40))) + "?"
+            options = [f"{label}. " + " ".join(rng.choice(words) for _ in range(rng.randint(1, 5))) for label in "abcd"]
+            item = {"passage": None, "question": question, "options": options, "label": rng.choice("abcd"), "answer": None}
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far (Linux reports ru_maxrss in KB).
+    It never resets, so run_suite runs every stage in its own process.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(stage, size, count, elapsed, latencies=None):
+    row = {
+        "stage": stage,
+        "size": size,
+        "items": count,
+        "seconds": elapsed,
+        "per_sec": count / elapsed if elapsed > 0 else float("inf"),
+        "p50_ms": None, "p95_ms": None, "p99_ms": None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if latencies is not None and len(latencies):
+        p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+        row.update(p50_ms=p50, p95_ms=p95, p99_ms=p99)
+    return row
+
+
+def timed(fn, latencies):
+    """Wraps fn so each call's duration is appended to `latencies`."""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def bench_build(dataset, size):
+    from .prompts import format_prompt
+
+    latencies = []
+    build = timed(format_prompt, latencies)
+    start = time.perf_counter()
+    for strategy in STRATEGIES:
+        for index, item in enumerate(dataset):
+            build(item["question"], item["options"], strategy, dataset=dataset, current_index=index)
+    return summarize("build", size, len(latencies), time.perf_counter() - start, latencies)
+
+
+def bench_dispatch(prompts, size, models, mock_options):
+    from .model_api import PROVIDERS, batch_query
+    from .mock_provider import register_mock_providers
+
+    register_mock_providers(models, **mock_options)
+    latencies = []
+    for provider in PROVIDERS.values():
+        provider["query"] = timed(provider["query"], latencies)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        batch_query(prompts)
+    return summarize("dispatch", size, len(prompts) * models, time.perf_counter() - start, latencies)
+
+
+def bench_cache(prompts, size, models, workdir):
+    from .model_api import batch_query
+    from .mock_provider import register_mock_providers
+    from .response_cache import ResponseCache
+
+    register_mock_providers(models, mean_latency=0)
+    cache = ResponseCache(path=os.path.join(workdir, f"cache-{size}.sqlite"), max_bytes=10 ** 12)
+    with contextlib.redirect_stdout(io.StringIO()):
+        batch_query(prompts, cache=cache)  # Cold pass fills the cache
+        start = time.perf_counter()
+        batch_query(prompts, cache=cache)  # Warm pass is served entirely from the cache
+        elapsed = time.perf_counter() - start
+    cache.close()
+    return summarize("cache", size, len(prompts) * models, elapsed)
+
+
+def bench_extract(dataset, size, seed=0):
+    from .post_process import AnswerExtractor
+    from .mock_provider import DEFAULT_TEMPLATES
+
+    rng = random.Random(seed)
+    extractor = AnswerExtractor()
+    latencies = []
+    extract = timed(extractor.extract, latencies)
+    start = time.perf_counter()
+    for item in dataset:
+        response = rng.choice(DEFAULT_TEMPLATES).format(label=rng.choice("abcd"))
+        extract(response, item["options"], rng.choice(STRATEGIES))
+    return summarize("extract", size, len(latencies), time.perf_counter() - start, latencies)
+
+
+def bench_metrics(dataset, size, seed=0):
+    from .metrics import label_metrics
+
+    rng = random.Random(seed)
+    correct_answers = [item["label"] for item in dataset]
+    predicted = [rng.choice("abcd") if rng.random() > 0.02 else None for _ in correct_answers]
+    start = time.perf_counter()
+    label_metrics(predicted, correct_answers)
+    return summarize("metrics", size, len(correct_answers), time.perf_counter() - start)
+
+
+def run_stage(stage, path, size, models=2, mock_options=None, workdir=None):
+    """Runs one stage over the synthetic dataset at `path` in this process and returns its result row."""
+    from .dataset_loader import JsonlDataset
+
+    dataset = JsonlDataset(path)
+    prompts = None
+    if stage in ("dispatch", "cache"):
+        from .prompts import format_prompt
+        prompts = [format_prompt(item["question"], item["options"], "zero-shot") for item in dataset]
+
+    if stage == "build":
+        row = bench_build(dataset, size)
+    elif stage == "dispatch":
+        row = bench_dispatch(prompts, size, models, mock_options or {"mean_latency": 0})
+    elif stage == "cache":
+        row = bench_cache(prompts, size, models, workdir or os.path.dirname(path))
+    elif stage == "extract":
+        row = bench_extract(dataset, size)
+    elif stage == "metrics":
+        row = bench_metrics(dataset, size)
+    else:
+        raise ValueError(f"❌ Invalid stage '{stage}'. Available: {STAGES}")
+    dataset.close()
+    return row
+
+
+STAGE_PROBE = "import json, sys; from src.perf import run_stage; print(json.dumps(run_stage(*json.loads(sys.argv[1]))))"
+
+
+def run_suite(sizes, stages=STAGES, models=2, mock_options=None):
+    """
+    Runs the selected pipeline stages over synthetic datasets of each size using
+    offline mock providers. Returns one result row per (size, stage).
+    Each (size, stage) runs in a fresh interpreter, so its peak memory is its own
+    rather than the running maximum of every stage before it.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    mock_options = mock_options or {"mean_latency": 0}
+    rows = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            path = os.path.join(workdir, f"synthetic_{size}.jsonl")
+            synthetic_dataset(path, size)
+
+            for stage in stages:
+                result = subprocess.run(
+                    [sys.executable, "-c", STAGE_PROBE, json.dumps([stage, path, size, models, mock_options, workdir])],
+                    cwd=root, capture_output=True, text=True,
+                )
+                if result.returncode != 0:
+                    raise RuntimeError(f"❌ Stage {stage} (size {size}) failed:\n{result.stderr}")
+                rows.append(json.loads(result.stdout.strip().splitlines()[-1]))
+                print(format_row(rows[-1]))
+    return rows
+
+
+def format_ms(value):
+    return f"{value:9.3f}" if value is not None else f"{'-':>9}"
+
+
+def format_row(row):
+    return (
+        f"{row['stage']:<9} {row['size']:>9} {row['items']:>10} {row['seconds']:>9.2f} {row['per_sec']:>12.0f} "
+        f"{format_ms(row['p50_ms'])} {format_ms(row['p95_ms'])} {format_ms(row['p99_ms'])} {row['peak_rss_mb']:>10.1f}"
+    )
+
+
+REPORT_HEADER = (
+    f"{'stage':<9} {'size':>9} {'items':>10} {'seconds':>9} {'items/sec':>12} "
+    f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak MB':>10}"
+)
+
+
+IMPORT_PROBE = (
+    "import time; start = time.perf_counter(); import run_benchmark; "
+    "run_benchmark.load_command({command!r}); print(time.perf_counter() - start)"
+)
+
+
+def measure_import_times(commands=None, repeats=5):
+    """
+    Cold import time of each run_benchmark.py subcommand, measured in a fresh
+    interpreter per repeat. Returns one row per command with the median and
+    whether it is within IMPORT_BUDGETS.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    rows = []
+    for command in commands or IMPORT_BUDGETS:
+        timings = []
+        for _ in range(repeats):
+            output = subprocess.run(
+                [sys.executable, "-c", IMPORT_PROBE.format(command=command)],
+                cwd=root, capture_output=True, text=True, check=True,
+            ).stdout
+            timings.append(float(output.strip().splitlines()[-1]))
+        median = float(np.median(timings))
+        rows.append({
+            "command": command,
+            "seconds": median,
+            "budget": IMPORT_BUDGETS[command],
+            "within_budget": median <= IMPORT_BUDGETS[command],
+        })
+    return rows
+
+
+def format_import_row(row):
+    status = "ok" if row["within_budget"] else "OVER"
+    return f"{row['command']:<9} {row['seconds'] * 1000:>9.0f} {row['budget'] * 1000:>9.0f} {status:>6}"
+
+
+IMPORT_HEADER = f"{'command':<9} {'import ms':>9} {'budget ms':>9} {'status':>6}"
@@ -1,44 +1,40 @@
 import re
 
-def extract_option_label(prediction, options, strategy):
-    prediction = prediction.strip().lower()
+VALID_LABELS = frozenset("abcde")
+MAX_OPTION_MAPS = 100000
 
-    def normalize(label):
-        return re.sub(r'[^\w]', '', label.lower())  # removes (, ), whitespace etc.
+# Define regex patterns for English and Hindi answer formats (compiled once, tried in order).
+# Each rule lists literal substrings one of which must occur for the pattern to match,
+# so most rules are skipped with a cheap `in` check instead of a regex search.
+PATTERNS = [
+    ("boxed", ("final answer",), re.compile(r'final answer\s*is\s*\$?\\?boxed\{?([a-e])\}?', re.IGNORECASE)),
+    ("answer", ("answer",), re.compile(r'answer\s*(is|:)?\s*\(?([a-e])\)?', re.IGNORECASE)),
+    ("option", ("option",), re.compile(r'option\s*\(?([a-e])\)?\s*(is\s*correct|is\s*true|is\s*the\s*answer)?', re.IGNORECASE)),
+    ("hindi_answer", ("उत्तर", "सही"), re.compile(r'(उत्तर|सही\s*विकल्प)\s*(है|:)?\s*\(?([a-e])\)?', re.IGNORECASE)),
+]
 
-    # Define regex patterns for English and Hindi answer formats
-    patterns = [
-        r'final answer\s*is\s*\$?\\?boxed\{?([a-e])\}?',
-        r'answer\s*(is|:)?\s*\(?([a-e])\)?',
-        r'option\s*\(?([a-e])\)?\s*(is\s*correct|is\s*true|is\s*the\s*answer)?',
-        r'(उत्तर|सही\s*विकल्प)\s*(है|:)?\s*\(?([a-e])\)?'
-    ]
+# Chain-of-thought: patterns checked against the last line only
+COT_PATTERNS = [
+    ("cot_answer", ("answer",), re.compile(r'answer\s*(is|:)?\s*\(?([a-e])\)?', re.IGNORECASE)),
+    ("cot_hindi_answer", ("उत्तर", "सही"), re.compile(r'(उत्तर|सही\s*विकल्प)\s*(है|:)?\s*\(?([a-e])\)?', re.IGNORECASE)),
+    ("cot_letter", None, re.compile(r'\(?([a-e])\)?', re.IGNORECASE)),  # Loose match for standalone letter
+]
 
-    for pattern in patterns:
-        match = re.search(pattern, prediction, re.IGNORECASE)
-        if match:
-            for group in match.groups()[::-1]:
-                if group and group.lower() in ['a', 'b', 'c', 'd','e']:
-                    return normalize(group)
-
-    # Chain-of-thought: Check the last line for a valid answer
-    if strategy == 'cot':
-        last_line = prediction.strip().split('\n')[-1]
-
-        cot_patterns = [
-            r'answer\s*(is|:)?\s*\(?([a-e])\)?',
-            r'(उत्तर|सही\s*विकल्प)\s*(है|:)?\s*\(?([a-e])\)?',
-            r'\(?([a-e])\)?'  # Loose match for standalone letter
-        ]
-
-        for pattern in cot_patterns:
-            match = re.search(pattern, last_line, re.IGNORECASE)
-            if match:
-                for group in match.groups()[::-1]:
-                    if group and group.lower() in ['a', 'b', 'c', 'd','e']:
-                        return normalize(group)
-
-    # Fallback: Match based on actual content of options
+LOOSE_LETTER = re.compile(r'\(?([a-e])\)?', re.IGNORECASE)
+
+
+def _match_label(needles, pattern, text):
+    if needles and not any(needle in text for needle in needles):
+        return None
+    match = pattern.search(text)
+    if match:
+        for group in match.groups()[::-1]:
+            if group and group.lower() in VALID_LABELS:
+                return group.lower()
+    return None
+
+
+def _build_option_map(options):
     option_map = {}
 
     for opt in options:
@@ -53,16 +49,83 @@ def extract_option_label(prediction, options, strategy):
         if len(parts) == 2:
             key = parts[1].strip().lower()
             val = parts[0].strip().lower()
-            option_map[key] = val
+            option_map[key] = re.sub(r'[^\w]', '', val)  # removes (, ), whitespace etc.
 
-    for key, value in option_map.items():
-        if key in prediction:
-            return normalize(value)
+    return option_map
 
-    # Last fallback → any standalone letter a-d
-    match = re.search(r'\(?([a-e])\)?', prediction, re.IGNORECASE)
-    if match:
-        return normalize(match.group(1))
 
-    return None
+class AnswerExtractor:
+    """
+    Extracts option labels from model responses using precompiled patterns.
+    Option-text maps are built once per distinct option list (i.e. once per
+    question of a dataset) and reused across strategies, models and reruns.
+    Each label comes with the name of the rule that produced it.
+    """
+
+    def __init__(self):
+        self._option_maps = {}
+
+    def option_map(self, options):
+        key = tuple(options)
+        option_map = self._option_maps.get(key)
+        if option_map is None:
+            if len(self._option_maps) >= MAX_OPTION_MAPS:
+                self._option_maps.clear()
+            option_map = self._option_maps[key] = _build_option_map(options)
+        return option_map
+
+    def extract(self, prediction, options, strategy):
+        """Returns (label, rule) for one response; label is None if nothing matched."""
+        prediction = prediction.strip().lower()
+
+        for rule, needles, pattern in PATTERNS:
+            label = _match_label(needles, pattern, prediction)
+            if label:
+                return label, rule
 
+        if strategy == 'cot':
+            last_line = prediction.split('\n')[-1]
+            for rule, needles, pattern in COT_PATTERNS:
+                label = _match_label(needles, pattern, last_line)
+                if label:
+                    return label, rule
+
+        # Fallback: Match based on actual content of options
+        for key, value in self.option_map(options).items():
+            if key in prediction:
+                return value, "option_text"
+
+        # Last fallback → any standalone letter a-e
+        match = LOOSE_LETTER.search(prediction)
+        if match:
+            return match.group(1).lower(), "loose_letter"
+
+        return None, "none"
+
+    def extract_batch(self, predictions, options_list, strategies):
+        """
+        Extracts labels for many responses at once.
+        `strategies` is a single strategy name or one per prediction.
+        Returns (labels, rules) as two lists aligned with `predictions`.
+        """
+        if isinstance(strategies, str):
+            strategies = [strategies] * len(predictions)
+
+        labels, rules = [], []
+        for prediction, options, strategy in zip(predictions, options_list, strategies):
+            label, rule = self.extract(prediction, options, strategy)
+            labels.append(label)
+            rules.append(rule)
+        return labels, rules
+
+
+_extractor = AnswerExtractor()
+
+
+def extract_option_labels(predictions, options_list, strategies):
+    """Batch version of extract_option_label; returns (labels, matched rules)."""
+    return _extractor.extract_batch(predictions, options_list, strategies)
+
+
+def extract_option_label(prediction, options, strategy):
+    return _extractor.extract(prediction, options, strategy)[0]
@@ -0,0 +1,80 @@
+import unicodedata
+from .dispatcher import estimate_tokens
+
+MIN_SHARED_PREFIX = 256  # Characters prompts must share before they are grouped for prefix reuse
+
+
+def normalize_prompt(text):
+    """Canonical prompt text: NFC Unicode, \\n line endings, no trailing whitespace on any line."""
+    text = unicodedata.normalize("NFC", text.replace("\r\n", "\n"))
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+
+def common_prefix_length(a, b):
+    """Length of the longest common prefix of a and b (binary search over slice comparisons)."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class PromptPlan:
+    """
+    Deduplicated, prefix-grouped view of a prompt batch.
+
+    prompts: the unique normalised prompts in dispatch order. They are sorted, so
+        prompts sharing a long prefix (the few-shot exemplar block, a shared passage)
+        are sent back to back and provider-side prefix caches stay warm.
+    positions[i]: index into `prompts` of input prompt i, used by expand().
+    groups: (prefix_length, [prompt indices]) for every run of two or more
+        prompts sharing at least `min_shared_prefix` characters.
+    """
+
+    def __init__(self, prompts, min_shared_prefix=MIN_SHARED_PREFIX):
+        normalized = [normalize_prompt(prompt) for prompt in prompts]
+        self.prompts = sorted(set(normalized))
+        rank = {prompt: i for i, prompt in enumerate(self.prompts)}
+        self.positions = [rank[prompt] for prompt in normalized]
+        self.duplicate_tokens = sum(estimate_tokens(prompt) for prompt in normalized) - sum(
+            estimate_tokens(prompt) for prompt in self.prompts
+        )
+
+        self.groups = []
+        prefix, members = 0, [0] if self.prompts else []
+        for i in range(1, len(self.prompts)):
+            shared = min(prefix or len(self.prompts[i - 1]), common_prefix_length(self.prompts[i - 1], self.prompts[i]))
+            if shared >= min_shared_prefix:
+                prefix = shared
+                members.append(i)
+                continue
+            if len(members) > 1:
+                self.groups.append((prefix, members))
+            prefix, members = 0, [i]
+        if len(members) > 1:
+            self.groups.append((prefix, members))
+
+    @property
+    def duplicates(self):
+        return len(self.positions) - len(self.prompts)
+
+    @property
+    def prefix_tokens(self):
+        """Prompt tokens a prefix-caching provider can reuse: the shared prefix of every group member but the first."""
+        return sum(estimate_tokens(self.prompts[members[0]][:prefix]) * (len(members) - 1)
+                   for prefix, members in self.groups)
+
+    def expand(self, values):
+        """Maps per-unique-prompt `values` back onto the original prompt order."""
+        return [values[position] for position in self.positions]
+
+    def summary(self):
+        grouped = sum(len(members) for _, members in self.groups)
+        return (
+            f"{len(self.positions)} prompts -> {len(self.prompts)} unique "
+            f"({self.duplicates} duplicates, ~{self.duplicate_tokens} tokens), "
+            f"{grouped} in {len(self.groups)} shared-prefix groups (~{self.prefix_tokens} prefix tokens reusable)"
+        )
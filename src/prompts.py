@@ -0,0 +1,81 @@
+from .few_shot import get_exemplar_pool, is_hindi
+from .dataset_loader import item_language
+from .config import STRATEGY_MODE, FEW_SHOT_POLICY, FEW_SHOT_SEED
+
+STRATEGIES = ["zero-shot", "few-shot", "cot"]
+
+
+def get_strategies(mode=STRATEGY_MODE):
+    return STRATEGIES if mode == "all" else [mode]
+
+
+def format_prompt(question, options, strategy, dataset=None, k=3, current_index=0, policy=FEW_SHOT_POLICY,
+                  language=None):
+    """
+    Formats the prompt based on the selected strategy and language.
+    `language` ("hi" or "en") comes from the dataset's metadata index when known;
+    otherwise the question's script is checked.
+    """
+    options_text = "\n".join(options)
+
+    # Language detection: check if question is in Hindi (Devanagari script)
+    is_hindi_lang = is_hindi(question) if language is None else language == "hi"
+
+    if strategy == "zero-shot":
+        instruction = (
+            "कृपया (a, b, c, या d) में से एक उत्तर चुनें। उत्तर:"
+            if is_hindi_lang else
+            "Answer with A, B, C, or D:"
+        )
+        return f"{question}\nOptions:\n{options_text}\n{instruction}"
+
+    elif strategy == "few-shot":
+        assert dataset is not None, "Dataset required for few-shot prompting."
+        # Exemplars are formatted once per dataset and reused across questions
+        few_shot_prompt = get_exemplar_pool(dataset, k, policy, FEW_SHOT_SEED).block(current_index)
+
+        instruction_final = (
+            "उत्तर:" if is_hindi_lang else "Answer:"
+        )
+
+        return f"{few_shot_prompt}\n\nQ: {question}\nOptions:\n{options_text}\n{instruction_final}"
+
+    elif strategy == "cot":
+        instruction = (
+            "कृपया चरण दर चरण सोचें और फिर (a, b, c, या d) में से उत्तर दें:"
+            if is_hindi_lang else
+            "Think step by step and then answer with A, B, C, or D:"
+        )
+        return f"{question}\nOptions:\n{options_text}\n{instruction}"
+
+    else:
+        raise ValueError("Invalid prompting strategy.")
+
+
+def tracking_id(category, dataset_name, strategy, index):
+    """Human-readable id of one prompt, e.g. Q_Law_lsat_lr_few-shot_1."""
+    return f"Q_{category}_{dataset_name}_{strategy}_{index + 1}"
+
+
+def build_prompts(category, dataset_name, dataset, strategies, indices=None, k=3):
+    """
+    Formats every (strategy, question) prompt of one dataset, or only of the
+    questions at `indices` (a chunk of it), with `k` few-shot exemplars.
+    Returns (prompts, metadata) where metadata[i] is (category, dataset_name, strategy, question_index).
+
+    The prompt text carries no tracking id (see tracking_id), so identical questions
+    across strategies, datasets and runs produce identical, cacheable prompts.
+    """
+    all_prompts = []
+    all_prompt_metadata = []
+
+    items = list(enumerate(dataset)) if indices is None else [(index, dataset[index]) for index in indices]
+    for strategy in strategies:
+        for index, item in items:
+            all_prompts.append(format_prompt(
+                item["question"], item["options"], strategy, dataset=dataset, k=k, current_index=index,
+                language=item_language(dataset, index),
+            ))
+            all_prompt_metadata.append((category, dataset_name, strategy, index))
+
+    return all_prompts, all_prompt_metadata
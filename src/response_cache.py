@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from .config import CACHE_PATH, CACHE_MAX_BYTES
+
+CACHE_MODES = ("use", "refresh", "off")
+EVICT_BATCH = 500  # Least recently used rows dropped per DELETE while the cache is over its size limit
+
+
+def cache_key(model_id, params, prompt):
+    """Content address of a request: hash of model id, generation params and exact prompt."""
+    payload = json.dumps([model_id, params or {}, prompt], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent SQLite store of model responses with size-based LRU eviction.
+    mode="use" reads and writes the cache, mode="refresh" ignores stored
+    responses but overwrites them with the new ones. The stored size is tracked
+    as responses are written, and put_many() evicts as soon as it exceeds max_bytes.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, mode="use"):
+        if mode not in ("use", "refresh"):
+            raise ValueError(f"❌ Invalid cache mode '{mode}'. Available: use, refresh")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # Shards of a run may share the cache file; wait for their write locks instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_used)")
+        self.size = self._stored_size()
+
+    def _stored_size(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get_many(self, keys):
+        """Returns {key: response} for every key already in the cache."""
+        found = {}
+        if self.mode == "use":
+            unique = list(set(keys))
+            for start in range(0, len(unique), 500):  # stay under SQLite's variable limit
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT key, response FROM responses WHERE key IN ({placeholders})", chunk
+                )
+                found.update(rows)
+            if found:
+                now = time.time()
+                self.conn.executemany("UPDATE responses SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+                self.conn.commit()
+
+        hits = sum(1 for k in keys if k in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def contains_many(self, keys):
+        """Returns the set of `keys` get_many would find, without counting hits or touching LRU order."""
+        found = set()
+        if self.mode == "use":
+            unique = list(set(keys))
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.update(key for key, in self.conn.execute(
+                    f"SELECT key FROM responses WHERE key IN ({placeholders})", chunk
+                ))
+        return found
+
+    def put_many(self, model_id, items):
+        """Stores (key, response) pairs for `model_id`, evicting old responses if the cache grows past max_bytes."""
+        now = time.time()
+        rows = [(key, model_id, response, len(response.encode("utf-8")), now) for key, response in items]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO responses (key, model, response, size, last_used) VALUES (?, ?, ?, ?, ?)", rows
+        )
+        self.conn.commit()
+        self.size += sum(row[3] for row in rows)  # Overcounts replaced rows; evict() recounts before deleting
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Drops least recently used responses, EVICT_BATCH at a time, until the cache fits in max_bytes."""
+        self.size = self._stored_size()  # Other processes may share the file
+        removed = 0
+        while self.size > self.max_bytes:
+            freed, count = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM "
+                "(SELECT size FROM responses ORDER BY last_used LIMIT ?)", (EVICT_BATCH,)
+            ).fetchone()
+            if not count:
+                break
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                (EVICT_BATCH,),
+            )
+            self.conn.commit()
+            self.size -= freed
+            removed += count
+        self.evicted += removed
+        return removed
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return f"Cache ({self.mode}): {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
+
+    def close(self):
+        if self._stored_size() > self.max_bytes:
+            self.evict()
+        if self.evicted:
+            print(f"🧹 Evicted {self.evicted} cached responses to stay under {self.max_bytes} bytes")
+        self.conn.close()
+
+
+def open_cache(mode="use"):
+    """Returns a ResponseCache for `mode`, or None when caching is off."""
+    if mode not in CACHE_MODES:
+        raise ValueError(f"❌ Invalid cache mode '{mode}'. Available: {list(CACHE_MODES)}")
+    return None if mode == "off" else ResponseCache(mode=mode)
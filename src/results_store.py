@@ -0,0 +1,369 @@
+import os
+import json
+import sqlite3
+import hashlib
+import textwrap
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from .config import RESULTS_STORE_PATH, RESULTS_PATH, RESULT_CHUNK_SIZE
+from .dataset_loader import question_id
+
+# Sorts before timestamped run ids, so any newer run supersedes imported results
+LEGACY_RUN_ID = "00000000-000000-legacy"
+
+RESULT_SCHEMA = pa.schema([
+    ("question_id", pa.string()),
+    ("index", pa.int64()),
+    ("response_id", pa.string()),
+    ("predicted_answer", pa.string()),
+    ("correct_answer", pa.string()),
+    ("is_correct", pa.bool_()),
+    ("extraction_rule", pa.string()),
+    ("error", pa.string()),  # Failure kind of requests that never got an answer, else null
+])
+QUESTION_SCHEMA = pa.schema([
+    ("question_id", pa.string()),
+    ("index", pa.int64()),
+    ("question", pa.string()),
+])
+RESPONSE_SCHEMA = pa.schema([
+    ("response_id", pa.string()),
+    ("model_answer", pa.string()),
+])
+
+
+def response_id(text):
+    return None if text is None else hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _parse_partition(path):
+    """('model=x', 'strategy=y', 'dataset=z') directory names -> (x, y, z)."""
+    parts = path.replace("\\", "/").rstrip("/").split("/")[-3:]
+    return tuple(part.split("=", 1)[1] for part in parts)
+
+
+class ResultsStore:
+    """
+    Columnar (Parquet) store of benchmark results.
+
+    runs/<run_id>/model=<m>/strategy=<s>/dataset=<d>/  one result table per partition
+    questions/<dataset>.parquet                          question text, one row per question id
+    responses/<run_id>/part-*.parquet                    response text, one row per distinct response
+
+    Result rows only hold ids, labels and correctness, so metrics are column
+    scans and question/response text is stored once however many models and
+    strategies reference it.
+
+    Shards of a run (`shard` = (I, N)) share the run's directories: each writes
+    its rows as part-0000I-*.parquet of every partition and its responses as
+    shard-I-part-*.parquet, so they never touch each other's files and readers
+    see the union of all shards.
+
+    Results are streamed: every write_results() call appends one row group to
+    the partition's open part file and new response texts to the open response
+    part, so only the current chunk is ever held in memory. Part files become
+    readable once close() writes their footers; writes after a close() go to
+    new part files. The first write to a partition replaces the parts this
+    shard wrote there in an earlier attempt (a resumed run rewrites them all).
+    """
+
+    def __init__(self, run_id, root=RESULTS_STORE_PATH, shard=None):
+        self.run_id = run_id
+        self.root = root
+        self.shard = shard
+        self.run_path = os.path.join(root, "runs", run_id)
+        self.responses_path = os.path.join(root, "responses", run_id)
+        self.questions_path = os.path.join(root, "questions")
+        for path in (self.run_path, self.responses_path, self.questions_path):
+            os.makedirs(path, exist_ok=True)
+        self._seen_responses = set()
+        self._response_prefix = "part-" if shard is None else f"shard-{shard[0]}-part-"
+        self._response_parts = sum(1 for f in os.listdir(self.responses_path) if f.startswith(self._response_prefix))
+        self._writers = {}  # Open ParquetWriter per partition, plus one under "responses"
+        self._parts = {}  # Part files written per partition by this store
+
+    def partition_path(self, model, strategy, dataset):
+        return os.path.join(self.run_path, f"model={model}", f"strategy={strategy}", f"dataset={dataset}")
+
+    def write_questions(self, dataset, chunks):
+        """
+        Upserts questions into the dataset's question table (one row per question id).
+        `chunks` yields (question_ids, indices, questions) lists; each is written as a row group.
+        """
+        path = os.path.join(self.questions_path, f"{dataset}.parquet")
+        # Replaced atomically: shards of a run rewrite the same question tables concurrently
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        written = []
+        with pq.ParquetWriter(tmp_path, QUESTION_SCHEMA) as writer:
+            for question_ids, indices, questions in chunks:
+                writer.write_table(pa.Table.from_pydict(
+                    {"question_id": question_ids, "index": indices, "question": questions}, schema=QUESTION_SCHEMA
+                ))
+                written.extend(question_ids)
+            if os.path.exists(path):
+                written = pa.array(written, pa.string())
+                for batch in pq.ParquetFile(path).iter_batches():
+                    keep = pc.invert(pc.is_in(batch.column("question_id"), value_set=written))
+                    writer.write_table(pa.Table.from_batches([batch]).filter(keep))
+        os.replace(tmp_path, path)
+
+    def _writer(self, key, path, schema):
+        if key not in self._writers:
+            self._writers[key] = pq.ParquetWriter(path, schema)
+        return self._writers[key]
+
+    def write_results(self, model, strategy, dataset, columns):
+        """
+        Appends rows to the (model, strategy, dataset) partition of this run.
+        `columns` holds the RESULT_SCHEMA columns except response_id, plus
+        "model_answer"; response texts not yet stored for this run are appended
+        to the run's response table. Returns the partition path.
+        """
+        answers = columns["model_answer"]
+        response_ids = [response_id(text) for text in answers]
+
+        new_ids, new_texts = [], []
+        for rid, text in zip(response_ids, answers):
+            if rid is not None and rid not in self._seen_responses:
+                self._seen_responses.add(rid)
+                new_ids.append(rid)
+                new_texts.append(text)
+        if new_ids:
+            if "responses" not in self._writers:
+                self._response_parts += 1
+            part = os.path.join(self.responses_path, f"{self._response_prefix}{self._response_parts - 1:05d}.parquet")
+            self._writer("responses", part, RESPONSE_SCHEMA).write_table(
+                pa.Table.from_pydict({"response_id": new_ids, "model_answer": new_texts}, schema=RESPONSE_SCHEMA)
+            )
+
+        table = pa.Table.from_pydict(
+            {name: (response_ids if name == "response_id" else columns[name]) for name in RESULT_SCHEMA.names},
+            schema=RESULT_SCHEMA,
+        )
+        key = (model, strategy, dataset)
+        path = self.partition_path(model, strategy, dataset)
+        if key not in self._writers:
+            prefix = f"part-{self.shard[0] if self.shard else 0:05d}"
+            if key not in self._parts:
+                os.makedirs(path, exist_ok=True)
+                for f in os.listdir(path):
+                    if f.startswith(prefix):
+                        os.remove(os.path.join(path, f))
+                self._parts[key] = 0
+            part = os.path.join(path, f"{prefix}-{self._parts[key]:05d}.parquet")
+            self._parts[key] += 1
+            self._writer(key, part, RESULT_SCHEMA)
+        self._writers[key].write_table(table)
+        return path
+
+    def close(self):
+        """Finishes every open part file, making everything written so far readable."""
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+
+def list_runs(root=RESULTS_STORE_PATH):
+    runs_path = os.path.join(root, "runs")
+    return sorted(os.listdir(runs_path)) if os.path.isdir(runs_path) else []
+
+
+def run_partitions(run_id, root=RESULTS_STORE_PATH):
+    """{(model, strategy, dataset): partition path} for one run."""
+    partitions = {}
+    run_path = os.path.join(root, "runs", run_id)
+    for dirpath, _, filenames in os.walk(run_path):
+        if any(f.endswith(".parquet") for f in filenames):
+            partitions[_parse_partition(dirpath)] = dirpath
+    return partitions
+
+
+def latest_partitions(root=RESULTS_STORE_PATH):
+    """{(model, strategy, dataset): partition path} taken from the latest run that wrote each partition."""
+    partitions = {}
+    for run_id in list_runs(root):  # Run ids sort chronologically, later runs win
+        partitions.update(run_partitions(run_id, root))
+    return partitions
+
+
+def _present_columns(path, parts, columns):
+    # Requested columns missing from older partitions (e.g. "error") are left out
+    if columns is None:
+        return None
+    present = set(pq.read_schema(os.path.join(path, parts[0])).names)
+    return [c for c in columns if c in present]
+
+
+def read_partition(path, columns=None):
+    """Reads every part file of a partition as one pyarrow Table."""
+    parts = sorted(f for f in os.listdir(path) if f.endswith(".parquet"))
+    columns = _present_columns(path, parts, columns)
+    return pa.concat_tables([pq.read_table(os.path.join(path, f), columns=columns) for f in parts])
+
+
+def iter_partition(path, columns=None, batch_size=RESULT_CHUNK_SIZE):
+    """Yields a partition's rows as pyarrow RecordBatches of at most `batch_size` rows, one part file at a time."""
+    parts = sorted(f for f in os.listdir(path) if f.endswith(".parquet"))
+    columns = _present_columns(path, parts, columns)
+    for f in parts:
+        yield from pq.ParquetFile(os.path.join(path, f)).iter_batches(batch_size=batch_size, columns=columns)
+
+
+def load_questions(dataset, question_ids=None, root=RESULTS_STORE_PATH):
+    """{question_id: text} for a dataset, optionally limited to `question_ids`."""
+    path = os.path.join(root, "questions", f"{dataset}.parquet")
+    filters = None if question_ids is None else [("question_id", "in", list(question_ids))]
+    table = pq.read_table(path, columns=["question_id", "question"], filters=filters)
+    return dict(zip(table.column("question_id").to_pylist(), table.column("question").to_pylist()))
+
+
+def load_responses(run_id, response_ids=None, root=RESULTS_STORE_PATH):
+    """{response_id: text} for a run, optionally limited to `response_ids` (filtered one row group at a time)."""
+    path = os.path.join(root, "responses", run_id)
+    wanted = None if response_ids is None else pa.array(list(response_ids), pa.string())
+    responses = {}
+    for f in sorted(os.listdir(path)) if os.path.isdir(path) else []:
+        for batch in pq.ParquetFile(os.path.join(path, f)).iter_batches():
+            table = pa.Table.from_batches([batch])
+            if wanted is not None:
+                table = table.filter(pc.is_in(table.column("response_id"), value_set=wanted))
+            responses.update(zip(table.column("response_id").to_pylist(), table.column("model_answer").to_pylist()))
+    return responses
+
+
+def _copy_group(db, run, dataset, paths, root):
+    """Copies partitions' rows, and the question and response texts they reference, into the export database."""
+    db.execute(
+        "CREATE TABLE rows (partition INTEGER, idx INTEGER, question_id TEXT, response_id TEXT, correct_answer TEXT,"
+        " predicted_answer TEXT, is_correct INTEGER, extraction_rule TEXT, error TEXT)"
+    )
+    db.execute("CREATE TABLE questions (question_id TEXT PRIMARY KEY, question TEXT)")
+    db.execute("CREATE TABLE responses (response_id TEXT PRIMARY KEY, model_answer TEXT)")
+    for number, path in enumerate(paths):
+        for batch in iter_partition(path):
+            columns = batch.to_pydict()
+            db.executemany("INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", zip(
+                [number] * batch.num_rows, columns["index"], columns["question_id"], columns["response_id"],
+                columns["correct_answer"], columns["predicted_answer"], columns["is_correct"],
+                columns["extraction_rule"], columns.get("error", [None] * batch.num_rows),
+            ))
+    db.execute("CREATE INDEX rows_order ON rows (partition, idx)")
+    db.execute("CREATE INDEX rows_question ON rows (question_id)")
+    db.execute("CREATE INDEX rows_response ON rows (response_id)")
+
+    # One pass over each text table, keeping only the texts some row references
+    question_path = os.path.join(root, "questions", f"{dataset}.parquet")
+    for batch in pq.ParquetFile(question_path).iter_batches(RESULT_CHUNK_SIZE, columns=["question_id", "question"]):
+        db.executemany(
+            "INSERT OR IGNORE INTO questions SELECT ?1, ?2 WHERE EXISTS (SELECT 1 FROM rows WHERE question_id = ?1)",
+            zip(batch.column("question_id").to_pylist(), batch.column("question").to_pylist()),
+        )
+    response_path = os.path.join(root, "responses", run)
+    for f in sorted(os.listdir(response_path)) if os.path.isdir(response_path) else []:
+        for batch in pq.ParquetFile(os.path.join(response_path, f)).iter_batches(RESULT_CHUNK_SIZE):
+            db.executemany(
+                "INSERT OR IGNORE INTO responses SELECT ?1, ?2 WHERE EXISTS (SELECT 1 FROM rows WHERE response_id = ?1)",
+                zip(batch.column("response_id").to_pylist(), batch.column("model_answer").to_pylist()),
+            )
+
+
+def export_legacy_json(run_id=None, results_path=RESULTS_PATH, root=RESULTS_STORE_PATH, partitions=None):
+    """
+    Writes results/<model>/<strategy>/<dataset>.json in the original layout.
+    Exports `partitions` of `run_id` (default: all of them), or the latest
+    version of every partition when no run_id is given. Partitions are exported
+    a dataset at a time through a temporary on-disk SQLite database: their rows
+    are copied in RESULT_CHUNK_SIZE batches, the dataset's question table and
+    the run's response parts are streamed through once, and each file is
+    written entry by entry from an indexed join in index order. Memory stays
+    flat whatever the number of rows.
+    """
+    if run_id is None:
+        found = latest_partitions(root)
+    else:
+        found = run_partitions(run_id, root)
+    if partitions is not None:
+        found = {key: path for key, path in found.items() if key in partitions}
+
+    groups = {}
+    for (model, strategy, dataset), path in found.items():
+        run = os.path.relpath(path, os.path.join(root, "runs")).replace("\\", "/").split("/")[0]
+        groups.setdefault((run, dataset), []).append((model, strategy, path))
+
+    for (run, dataset), members in groups.items():
+        db = sqlite3.connect("")  # Private temporary database, deleted on close
+        try:
+            _copy_group(db, run, dataset, [path for *_, path in members], root)
+            for number, (model, strategy, _) in enumerate(members):
+                result_dir = os.path.join(results_path, model, strategy)
+                os.makedirs(result_dir, exist_ok=True)
+                rows = db.execute(
+                    "SELECT q.question, s.model_answer, r.correct_answer, r.predicted_answer, r.is_correct,"
+                    " r.extraction_rule, r.error FROM rows r"
+                    " LEFT JOIN questions q ON q.question_id = r.question_id"
+                    " LEFT JOIN responses s ON s.response_id = r.response_id"
+                    " WHERE r.partition = ? ORDER BY r.idx, r.rowid",  # Shards' and chunks' rows interleave indices
+                    (number,),
+                )
+                with open(os.path.join(result_dir, f"{dataset}.json"), "w", encoding="utf-8") as f:
+                    # Same text json.dump(entries, f, indent=4) writes, one entry at a time
+                    f.write("[")
+                    written = 0
+                    for question, answer, correct, predicted, is_correct, rule, error in rows:
+                        entry = {
+                            "question": question,
+                            "model": model,
+                            "model_answer": answer,
+                            "correct_answer": correct,
+                            "predicted_answer": predicted,
+                            "is_correct": None if is_correct is None else bool(is_correct),
+                            "strategy": strategy,
+                            "extraction_rule": rule,
+                            "error": error,
+                        }
+                        separator = "\n" if written == 0 else ",\n"
+                        f.write(separator + textwrap.indent(json.dumps(entry, indent=4, ensure_ascii=False), "    "))
+                        written += 1
+                    f.write("\n]" if written else "]")
+        finally:
+            db.close()
+
+    return len(found)
+
+
+def import_legacy_json(results_path=RESULTS_PATH, run_id=LEGACY_RUN_ID, root=RESULTS_STORE_PATH):
+    """Loads an existing results/<model>/<strategy>/<dataset>.json tree into the store as one run."""
+    store = ResultsStore(run_id, root)
+    imported = 0
+    for model in sorted(os.listdir(results_path)) if os.path.isdir(results_path) else []:
+        model_path = os.path.join(results_path, model)
+        if not os.path.isdir(model_path):
+            continue
+        for strategy in sorted(os.listdir(model_path)):
+            strategy_path = os.path.join(model_path, strategy)
+            if not os.path.isdir(strategy_path):
+                continue
+            for file_name in sorted(os.listdir(strategy_path)):
+                if not file_name.endswith(".json"):
+                    continue
+                dataset = file_name[:-len(".json")]
+                with open(os.path.join(strategy_path, file_name), "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+
+                # Legacy files hold one entry per dataset item, in dataset order
+                question_ids = [question_id(dataset, i) for i in range(len(entries))]
+                store.write_questions(dataset, [(question_ids, list(range(len(entries))), [e["question"] for e in entries])])
+                store.write_results(model, strategy, dataset, {
+                    "question_id": question_ids,
+                    "index": list(range(len(entries))),
+                    "model_answer": [e["model_answer"] for e in entries],
+                    "predicted_answer": [e["predicted_answer"] for e in entries],
+                    "correct_answer": [e["correct_answer"] for e in entries],
+                    "is_correct": [e["is_correct"] for e in entries],
+                    "extraction_rule": [e.get("extraction_rule") for e in entries],
+                    "error": [e.get("error") for e in entries],
+                })
+                imported += 1
+    store.close()
+    return imported
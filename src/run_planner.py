@@ -0,0 +1,212 @@
+import os
+import json
+import threading
+from .dispatcher import estimate_tokens, format_duration
+from .config import CALIBRATION_PATH, OUTPUT_TOKEN_ESTIMATES
+
+
+class TokenCalibration:
+    """
+    Measured token usage, kept between runs to correct the local estimates.
+
+    For every model it sums the input and output tokens providers reported next
+    to estimate_tokens() of the same prompts and responses; their ratios scale
+    future estimates. It also keeps the mean estimated response length per
+    (model, strategy) from the latest run, since CoT answers are far longer.
+    """
+
+    def __init__(self, path=CALIBRATION_PATH):
+        self.path = path
+        self.models = {}
+        self.responses = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.models = data.get("models", {})
+            self.responses = data.get("responses", {})
+        self._lengths = {}  # "model|strategy" -> [estimated tokens, responses] seen in this run
+        self._lock = threading.Lock()
+
+    def record_call(self, model, prompt, response, usage):
+        """Adds one provider-reported usage ({"input_tokens", "output_tokens"}) to the model's totals."""
+        with self._lock:
+            totals = self.models.setdefault(model, {
+                "calls": 0, "estimated_input": 0, "input": 0, "estimated_output": 0, "output": 0,
+            })
+            totals["calls"] += 1
+            totals["estimated_input"] += estimate_tokens(prompt)
+            totals["input"] += usage["input_tokens"]
+            totals["estimated_output"] += estimate_tokens(response)
+            totals["output"] += usage["output_tokens"]
+
+    def record_responses(self, model, strategy, responses):
+        """
+        Adds the answered `responses` of one strategy to this run's mean estimated
+        response length, which replaces the stored one. Can be called chunk by chunk.
+        """
+        answered = [response for response in responses if isinstance(response, str) and response]
+        if answered:
+            key = f"{model}|{strategy}"
+            lengths = self._lengths.setdefault(key, [0, 0])
+            lengths[0] += sum(estimate_tokens(r) for r in answered)
+            lengths[1] += len(answered)
+            self.responses[key] = lengths[0] / lengths[1]
+
+    def ratio(self, model, kind):
+        """Provider-reported / estimated tokens for kind "input" or "output" (1.0 until measured)."""
+        totals = self.models.get(model)
+        if not totals or not totals[f"estimated_{kind}"]:
+            return 1.0
+        return totals[kind] / totals[f"estimated_{kind}"]
+
+    def input_tokens(self, model, prompts):
+        return sum(estimate_tokens(prompt) for prompt in prompts) * self.ratio(model, "input")
+
+    def output_tokens(self, model, strategy):
+        measured = self.responses.get(f"{model}|{strategy}")
+        if measured is None:
+            return OUTPUT_TOKEN_ESTIMATES.get(strategy, 256)
+        return measured * self.ratio(model, "output")
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"  # Shards of a run may save at the same time
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"models": self.models, "responses": self.responses}, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+class RunPlanner:
+    """
+    Predicts tokens, cost and wall time of the prompts about to be sent and keeps
+    a run under a hard spending `limit` (USD) one dataset at a time: a dataset is
+    only started if its estimate fits in what is left. Estimates can be low, so
+    dispatch also reserves each request's estimated cost before sending it
+    (reserve()) and stops sending once spend plus reservations reach the limit;
+    the run overshoots by at most one request. A reservation is the estimate or
+    the model's mean actual cost per call so far in this run, whichever is
+    higher, so underestimated answer lengths stop skewing it after the first
+    responses. A reservation is settled by the
+    actual cost when its response is charged (record()) or dropped if the call
+    fails (release()). Spend is tracked from the usage providers report, or
+    from estimates for providers that report none.
+    """
+
+    def __init__(self, providers, limit=None, calibration=None):
+        self.providers = providers
+        self.limit = limit
+        self.calibration = calibration or TokenCalibration()
+        self.spent = 0.0
+        self.reserved = 0.0
+        self.skipped = []
+        self._reservations = {}  # (model, prompt) -> estimated costs of its calls in flight
+        self._charged = {}  # model -> [actual cost, calls] charged in this run
+        self._lock = threading.Lock()
+
+    def cost(self, name, input_tokens, output_tokens):
+        pricing = self.providers[name].get("pricing") or {}
+        return (input_tokens * pricing.get("input", 0) + output_tokens * pricing.get("output", 0)) / 1e6
+
+    def estimate(self, name, prompts, strategies):
+        """Calls, input/output tokens, cost and minutes for sending `prompts` (one strategy each) to model `name`."""
+        input_tokens = self.calibration.input_tokens(name, prompts)
+        output_tokens = sum(self.calibration.output_tokens(name, strategy) for strategy in strategies)
+        limits = self.providers[name]["limits"]
+        return {
+            "calls": len(prompts),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cost": self.cost(name, input_tokens, output_tokens),
+            # Requests and tokens per minute bound the wall time, whichever is tighter
+            "minutes": max(len(prompts) / limits["rpm"], (input_tokens + output_tokens) / limits["tpm"]),
+        }
+
+    def admit(self, label, estimates):
+        """
+        True if work with these per-model estimates fits in the remaining budget.
+        Rejected work is remembered under `label` for the end-of-run summary.
+        """
+        cost = sum(e["cost"] for e in estimates.values())
+        if self.limit is None or self.spent + cost <= self.limit:
+            return True
+        self.skipped.append(label)
+        return False
+
+    def exhausted(self):
+        """True once the actual spend plus what calls in flight reserved has reached the limit."""
+        return self.limit is not None and self.spent + self.reserved >= self.limit
+
+    def reserve(self, name, prompt, strategy=None):
+        """
+        Reserves the estimated cost of one call of `prompt` to model `name` (answered
+        in `strategy`) before it is sent. Returns False, reserving nothing, once exhausted.
+        """
+        cost = self.cost(name, self.calibration.input_tokens(name, [prompt]), self.calibration.output_tokens(name, strategy))
+        with self._lock:
+            if self.exhausted():
+                return False
+            charged, calls = self._charged.get(name, (0.0, 0))
+            if calls:
+                cost = max(cost, charged / calls)
+            self.reserved += cost
+            self._reservations.setdefault((name, prompt), []).append(cost)
+        return True
+
+    def release(self, name, prompt):
+        """Drops one reservation of a call that ended without a response to charge."""
+        self.charge(0.0, (name, prompt))
+
+    def charge(self, cost, reservation=None):
+        """Adds `cost` to the spend, settling one reservation of the (model, prompt) `reservation` if any."""
+        with self._lock:
+            self.spent += cost
+            costs = self._reservations.get(reservation)
+            if costs:
+                self.reserved -= costs.pop()
+                if not costs:
+                    del self._reservations[reservation]
+
+    def record(self, name, prompt, response, usage=None):
+        """Charges one response, calibrating the estimates when the provider reported its usage."""
+        if usage is not None:
+            self.calibration.record_call(name, prompt, response, usage)
+            input_tokens, output_tokens = usage["input_tokens"], usage["output_tokens"]
+        else:
+            input_tokens = self.calibration.input_tokens(name, [prompt])
+            output_tokens = estimate_tokens(response) * self.calibration.ratio(name, "output")
+        cost = self.cost(name, input_tokens, output_tokens)
+        with self._lock:
+            charged = self._charged.setdefault(name, [0.0, 0])
+            charged[0] += cost
+            charged[1] += 1
+        self.charge(cost, (name, prompt))
+
+    def summary(self):
+        limit = f" of ${self.limit:.2f} budget" if self.limit is not None else ""
+        skipped = f"; skipped to stay in budget: {', '.join(self.skipped)}" if self.skipped else ""
+        return f"~${self.spent:.4f}{limit}{skipped}"
+
+
+def combine_estimates(parts):
+    """Sums per-model estimates of consecutive chunks of work ({name: estimate} dicts) into one."""
+    total = {}
+    for estimates in parts:
+        for name, e in estimates.items():
+            if name in total:
+                total[name] = {key: total[name][key] + value for key, value in e.items()}
+            else:
+                total[name] = dict(e)
+    return total
+
+
+def format_estimates(estimates):
+    """One line per model plus the wall time (providers run concurrently, so the slowest one)."""
+    lines = [
+        f"   {name}: {e['calls']} calls, ~{e['input_tokens']:.0f} in / ~{e['output_tokens']:.0f} out tokens, "
+        f"${e['cost']:.4f}, >= {format_duration(e['minutes'] * 60)}"
+        for name, e in estimates.items()
+    ]
+    cost = sum(e["cost"] for e in estimates.values())
+    minutes = max((e["minutes"] for e in estimates.values()), default=0)
+    lines.append(f"   total: ${cost:.4f}, >= {format_duration(minutes * 60)} at the configured rate limits")
+    return "\n".join(lines)
@@ -0,0 +1,65 @@
+import random
+import numpy as np
+from .config import ADAPTIVE_MIN_QUESTIONS
+from .dataset_loader import item_language
+from .metrics import bootstrap_ci
+
+
+def stratified_order(dataset, key=item_language, seed=0):
+    """
+    Every question index of `dataset` in a seeded random order in which each
+    `key(dataset, index)` stratum keeps its share of every prefix: item i of a
+    stratum of size m is placed at fraction (i + 0.5) / m of the order. Any
+    batch taken from the front is then a stratified sample. The default key
+    reads the dataset's metadata index, so no item is parsed.
+    """
+    strata = {}
+    for index in range(len(dataset)):
+        strata.setdefault(key(dataset, index), []).append(index)
+
+    rng = random.Random(seed)
+    placed = []
+    for members in strata.values():
+        rng.shuffle(members)
+        placed.extend(((i + 0.5) / len(members), rng.random(), index) for i, index in enumerate(members))
+    return [index for *_, index in sorted(placed)]
+
+
+class AdaptiveSampler:
+    """
+    Running accuracy, with a bootstrap confidence interval, of every (model,
+    strategy) on one dataset while it is sampled batch by batch. done() is
+    True once each of them has `min_questions` scored answers and a CI half-width
+    of at most `precision` accuracy points.
+    """
+
+    def __init__(self, precision, min_questions=ADAPTIVE_MIN_QUESTIONS):
+        self.precision = precision
+        self.min_questions = min_questions
+        self.correct = {}
+
+    def add(self, key, columns):
+        """Adds the scored rows of a written result chunk (failed requests are not scored)."""
+        self.correct.setdefault(key, []).extend(
+            bool(correct) for correct, error in zip(columns["is_correct"], columns["error"]) if not error
+        )
+
+    def estimate(self, key):
+        """(n, accuracy, ci_low, ci_high) in percent."""
+        correct = np.asarray(self.correct.get(key, []), dtype=np.float32)
+        low, high = bootstrap_ci(correct)
+        return len(correct), (correct.mean() * 100 if len(correct) else 0.0), low * 100, high * 100
+
+    def precise(self, key):
+        n, _, low, high = self.estimate(key)
+        return n >= self.min_questions and (high - low) / 2 <= self.precision
+
+    def done(self):
+        return bool(self.correct) and all(self.precise(key) for key in self.correct)
+
+    def summary(self):
+        return "\n".join(
+            f"   {model} | {strategy}: {accuracy:.2f}% ({low:.2f}-{high:.2f}), N: {n}"
+            for (model, strategy), (n, accuracy, low, high) in
+            ((key, self.estimate(key)) for key in sorted(self.correct))
+        )
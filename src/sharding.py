@@ -0,0 +1,122 @@
+import os
+import sys
+import argparse
+import json
+import time
+import hashlib
+import subprocess
+from .config import RESULTS_STORE_PATH, RUNS_PATH
+
+
+def parse_shard(text):
+    """"I/N" (0 <= I < N) -> (I, N). Raises ArgumentTypeError, so argparse shows the message when used as a type."""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"❌ Invalid shard '{text}'. Expected I/N, e.g. 0/4") from None
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"❌ Invalid shard '{text}': I must be between 0 and N-1")
+    return index, count
+
+
+def shard_name(shard):
+    return f"shard-{shard[0]}-of-{shard[1]}"
+
+
+def shard_of(model, prompt, count):
+    """Shard (0..count-1) owning `model`'s answer to a normalised prompt. A stable hash, so every process and host agrees."""
+    key = f"{model}|{prompt}".encode("utf-8")
+    return int(hashlib.sha256(key).hexdigest()[:16], 16) % count
+
+
+def shard_assignments(models, prompts, shard=None):
+    """
+    {model: [index into prompts, ...]} of the work units (one model answering one
+    (strategy, dataset, index) prompt) that `shard` (I, N) owns; every unit when
+    shard is None. Units are assigned by the hash of their normalised prompt, so
+    units sharing a prompt text land in the same shard and no prompt is sent by
+    two shards, however the dataset is chunked.
+    """
+    if shard is None:
+        return {model: list(range(len(prompts))) for model in models}
+    from .prompt_plan import normalize_prompt
+
+    normalized = [normalize_prompt(prompt) for prompt in prompts]
+    return {
+        model: [i for i, prompt in enumerate(normalized) if shard_of(model, prompt, shard[1]) == shard[0]]
+        for model in models
+    }
+
+
+def shards_path(run_id, root=RESULTS_STORE_PATH):
+    return os.path.join(root, "runs", run_id, "_shards")
+
+
+def mark_shard_done(run_id, shard, summary, root=RESULTS_STORE_PATH):
+    """Records that `shard` of run `run_id` finished, next to its results in the shared store."""
+    path = shards_path(run_id, root)
+    os.makedirs(path, exist_ok=True)
+    tmp_path = os.path.join(path, f"{shard_name(shard)}.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"shard": shard[0], "shards": shard[1], "finished": time.time(), **summary}, f, indent=4)
+    os.replace(tmp_path, os.path.join(path, f"{shard_name(shard)}.json"))
+
+
+def shard_status(run_id, root=RESULTS_STORE_PATH):
+    """(shard count, {shard index: completion record}) of a sharded run."""
+    path = shards_path(run_id, root)
+    records = []
+    for file_name in sorted(os.listdir(path)) if os.path.isdir(path) else []:
+        if file_name.endswith(".json"):
+            with open(os.path.join(path, file_name), "r", encoding="utf-8") as f:
+                records.append(json.load(f))
+    counts = {record["shards"] for record in records}
+    if len(counts) > 1:
+        raise ValueError(f"❌ Run {run_id} mixes shard counts {sorted(counts)}; rerun it under a new run id.")
+    return (counts.pop() if counts else 0), {record["shard"]: record for record in records}
+
+
+def merge_shards(run_id, root=RESULTS_STORE_PATH, force=False):
+    """
+    Checks that every shard of `run_id` finished and writes the results/ JSON
+    tree for the run. Shards already wrote their part files into the same
+    partitions, so the store itself needs no merging. Returns the partition count.
+    """
+    from .results_store import export_legacy_json
+
+    count, done = shard_status(run_id, root)
+    if not count:
+        raise FileNotFoundError(f"❌ No finished shards found for run {run_id} in '{shards_path(run_id, root)}'.")
+    missing = [i for i in range(count) if i not in done]
+    if missing and not force:
+        raise RuntimeError(
+            f"❌ Run {run_id}: shards {', '.join(map(str, missing))} of {count} have not finished "
+            f"(rerun them with `run --shard I/{count} --resume {run_id}`, or merge with --force)."
+        )
+    return export_legacy_json(run_id=run_id, root=root)
+
+
+def launch_shards(count, run_id, options=()):
+    """
+    Runs `run_benchmark.py run --shard I/count --run-id run_id <options>` for every
+    shard as a local process and waits for them all. Each shard's output goes to
+    runs/<run_id>.shard-I-of-N.log. Returns the shards that failed.
+    """
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "run_benchmark.py")
+    os.makedirs(RUNS_PATH, exist_ok=True)
+    processes = {}
+    for index in range(count):
+        log_path = os.path.join(RUNS_PATH, f"{run_id}.{shard_name((index, count))}.log")
+        log = open(log_path, "w", encoding="utf-8")
+        command = [sys.executable, script, "run", "--shard", f"{index}/{count}", "--run-id", run_id, *options]
+        processes[index] = (subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), log, log_path)
+        print(f"🚀 Shard {index}/{count}: pid {processes[index][0].pid}, log {log_path}")
+
+    failed = []
+    for index, (process, log, log_path) in processes.items():
+        code = process.wait()
+        log.close()
+        print(f"{'✅' if code == 0 else '❌'} Shard {index}/{count} exited with {code}")
+        if code != 0:
+            failed.append(index)
+    return failed
@@ -0,0 +1,287 @@
+import os
+import csv
+import random
+import contextlib
+from collections import namedtuple
+from functools import partial
+import numpy as np
+from .config import (
+    BENCHMARK_CATEGORIES, DATASET_CATEGORIES, CACHE_MODE, LOG_PATH, SWEEP_ROUND_SIZE, SWEEP_MIN_QUESTIONS,
+)
+from .dataset_loader import load_dataset
+from .model_api import PROVIDERS, register_provider, batch_query
+from .prompts import STRATEGIES, build_prompts, get_strategies, tracking_id
+from .benchmark import write_model_results
+from .results_store import ResultsStore
+from .response_cache import open_cache
+from .checkpoint import RunJournal
+from .metrics import bootstrap_ci
+
+# One configuration of a sweep; k is None for strategies without exemplars, temperature None for the provider default
+Cell = namedtuple("Cell", ["model", "strategy", "k", "temperature"])
+
+SPEC_KEYS = {"name", "categories", "models", "strategies", "k", "temperature", "round_size", "seed", "stop"}
+STOP_KEYS = {"ci_width", "min_questions"}
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def load_spec(path):
+    """
+    Reads a sweep spec from TOML (.toml) or YAML (.yaml / .yml, needs PyYAML) and fills in defaults:
+
+        name = "k-and-temperature"          # default: the file name
+        categories = ["Law"]                # default: BENCHMARK_CATEGORIES
+        models = ["gemini", "together"]     # default: every registered provider
+        strategies = ["zero-shot", "few-shot"]
+        k = [1, 3, 5]                       # few-shot exemplars, each at least 1; other strategies ignore it
+        temperature = [0.0, 0.7]            # default: the provider's own setting
+        round_size = 50                     # questions per dataset per round
+        seed = 0                            # question order
+        [stop]
+        ci_width = 4.0                      # stop a cell once its CI is at most this many points wide
+        min_questions = 100
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".toml":
+        import tomllib
+
+        with open(path, "rb") as f:
+            spec = tomllib.load(f)
+    elif ext in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("❌ YAML sweep specs need PyYAML (pip install pyyaml); TOML specs need nothing extra.") from None
+        with open(path, "r", encoding="utf-8") as f:
+            spec = yaml.safe_load(f) or {}
+    else:
+        raise ValueError(f"❌ Unknown sweep spec format '{ext}'. Use .toml, .yaml or .yml")
+
+    stop = spec.get("stop", {})
+    unknown = (set(spec) - SPEC_KEYS) | (set(stop) - STOP_KEYS)
+    if unknown:
+        raise ValueError(f"❌ Unknown sweep spec keys: {sorted(unknown)}")
+    spec = {
+        "name": spec.get("name", os.path.splitext(os.path.basename(path))[0]),
+        "categories": _as_list(spec.get("categories", BENCHMARK_CATEGORIES)),
+        "models": _as_list(spec.get("models", list(PROVIDERS))),
+        "strategies": _as_list(spec.get("strategies", get_strategies())),
+        "k": _as_list(spec.get("k", 3)),
+        "temperature": _as_list(spec.get("temperature", [None])),
+        "round_size": spec.get("round_size", SWEEP_ROUND_SIZE),
+        "seed": spec.get("seed", 0),
+        "ci_width": stop.get("ci_width"),
+        "min_questions": stop.get("min_questions", SWEEP_MIN_QUESTIONS),
+    }
+    for key, known in (("categories", DATASET_CATEGORIES), ("models", PROVIDERS), ("strategies", STRATEGIES)):
+        invalid = [value for value in spec[key] if value not in known]
+        if invalid:
+            raise ValueError(f"❌ Invalid {key} {invalid} in sweep spec. Available: {list(known)}")
+    invalid = [k for k in spec["k"] if isinstance(k, bool) or not isinstance(k, int) or k < 1]
+    if invalid:
+        raise ValueError(f"❌ Invalid k {invalid} in sweep spec. k counts few-shot exemplars and must be at least 1")
+    return spec
+
+
+def expand_grid(spec):
+    """Every distinct Cell of models x strategies x k x temperature, in spec order."""
+    cells = []
+    for model in spec["models"]:
+        for strategy in spec["strategies"]:
+            for k in spec["k"]:
+                for temperature in spec["temperature"]:
+                    cell = Cell(model, strategy, k if strategy == "few-shot" else None, temperature)
+                    if cell not in cells:
+                        cells.append(cell)
+    return cells
+
+
+def variant_name(model, temperature):
+    """Provider (and partition) name of a model at one temperature, e.g. gemini_t0.7."""
+    return model if temperature is None else f"{model}_t{temperature:g}"
+
+
+def strategy_label(strategy, k):
+    """Partition name of a strategy at one k, e.g. few-shot_k5."""
+    return strategy if k is None else f"{strategy}_k{k}"
+
+
+@contextlib.contextmanager
+def variant_providers(cells):
+    """
+    Registers one provider per (model, temperature) of the sweep, restoring the
+    registry afterwards. Variants of a model share its rate limits evenly and
+    keep its model id, so their answers are cached under the model and settings.
+    """
+    temperatures = {}
+    for cell in cells:
+        temperatures.setdefault(cell.model, []).append(cell.temperature)
+    saved = dict(PROVIDERS)
+    try:
+        for model, values in temperatures.items():
+            values = list(dict.fromkeys(values))
+            provider = saved[model]
+            limits = {
+                "rpm": provider["limits"]["rpm"] / len(values),
+                "tpm": provider["limits"]["tpm"] / len(values),
+                "concurrency": max(1, provider["limits"]["concurrency"] // len(values)),
+            }
+            for temperature in values:
+                params = dict(provider["params"])
+                query = provider["query"]
+                if temperature is not None:
+                    params["temperature"] = temperature
+                    query = partial(query, params=params)
+                register_provider(variant_name(model, temperature), query, limits, provider["model_id"], params,
+                                  provider["pricing"])
+        yield
+    finally:
+        PROVIDERS.clear()
+        PROVIDERS.update(saved)
+
+
+def cell_summary(cell_state):
+    correct = np.asarray(cell_state["correct"], dtype=np.float32)
+    low, high = bootstrap_ci(correct)
+    return {
+        "n": len(correct),
+        "accuracy": correct.mean() * 100 if len(correct) else 0.0,
+        "ci_low": low * 100,
+        "ci_high": high * 100,
+    }
+
+
+def run_sweep(spec, cache_mode=CACHE_MODE, resume=False, run_id=None):
+    """
+    Runs every cell of a sweep spec (see load_spec) in interleaved rounds.
+
+    Each round takes the next `round_size` questions of every dataset (in a
+    seeded random order, so partial accuracies are unbiased), builds each
+    (strategy, k) prompt set once for all models and temperatures, and sends
+    the whole round as one batch, with every provider variant limited to the
+    prompts of its still-running cells. Results go to the results store as
+    partitions model=<model>[_t<temperature>] / strategy=<strategy>[_k<k>]
+    after every round, so every cell has partial results early. With a
+    `ci_width` stop rule, a cell stops once its CI is that narrow (after
+    `min_questions`), and later rounds skip it.
+    Returns {Cell: summary} and writes logs/sweep_<name>.csv.
+    """
+    cells = expand_grid(spec)
+    datasets = []
+    for category in spec["categories"]:
+        for dataset_name, dataset in load_dataset(category).get(category, {}).items():
+            order = list(range(len(dataset)))
+            random.Random(f"{spec['seed']}|{dataset_name}").shuffle(order)
+            datasets.append((category, dataset_name, dataset, order))
+    total = sum(len(order) for *_, order in datasets)
+    size = spec["round_size"]
+    rounds = max((len(order) for *_, order in datasets), default=0)
+    rounds = (rounds + size - 1) // size
+
+    cache = open_cache(cache_mode)
+    journal = RunJournal(run_id, resume=resume)
+    store = ResultsStore(journal.run_id)
+    state = {cell: {"correct": [], "failed": 0, "asked": 0, "stopped": None} for cell in cells}
+    print(f"🧪 Sweep {spec['name']} (run {journal.run_id}): {len(cells)} cells x {total} questions, "
+          f"{rounds} rounds of {size} questions per dataset")
+
+    try:
+        with variant_providers(cells):
+            for number in range(rounds):
+                active = [cell for cell in cells if state[cell]["stopped"] is None]
+                if not active:
+                    break
+
+                # One prompt set per (dataset, strategy, k), shared by every model and temperature
+                prompts, groups = [], []
+                for category, dataset_name, dataset, order in datasets:
+                    indices = order[number * size:(number + 1) * size]
+                    if not indices:
+                        continue
+                    for strategy, k in dict.fromkeys((cell.strategy, cell.k) for cell in active):
+                        group_prompts, metadata = build_prompts(
+                            category, dataset_name, dataset, [strategy], indices, k=k
+                        )
+                        groups.append((dataset_name, dataset, strategy, k, len(prompts), metadata))
+                        prompts.extend(group_prompts)
+
+                assignments = {}
+                for cell in active:
+                    selected = assignments.setdefault(variant_name(cell.model, cell.temperature), [])
+                    for _, _, strategy, k, start, metadata in groups:
+                        if (strategy, k) == (cell.strategy, cell.k):
+                            selected.extend(range(start, start + len(metadata)))
+                print(f"\n🔄 Round {number + 1}/{rounds}: {len(active)} cells, {len(prompts)} prompts")
+                responses = batch_query(
+                    prompts, models=list(assignments), cache=cache, journal=journal,
+                    labels=[tracking_id(*unit) for *_, metadata in groups for unit in metadata],
+                    assignments=assignments,
+                )
+
+                for cell in active:
+                    name = variant_name(cell.model, cell.temperature)
+                    for dataset_name, dataset, strategy, k, start, metadata in groups:
+                        if (strategy, k) != (cell.strategy, cell.k):
+                            continue
+                        written = write_model_results(
+                            store, name, dataset_name, dataset, metadata,
+                            responses[name][start:start + len(metadata)], label=strategy_label(strategy, k),
+                        )
+                        for columns in written.values():
+                            state[cell]["asked"] += len(columns["is_correct"])
+                            state[cell]["failed"] += sum(1 for error in columns["error"] if error)
+                            state[cell]["correct"] += [bool(c) for c, e in zip(columns["is_correct"], columns["error"]) if not e]
+                store.close()  # Partial results of every cell are readable after each round
+
+                for cell in active:
+                    summary = cell_summary(state[cell])
+                    width = summary["ci_high"] - summary["ci_low"]
+                    stop = (spec["ci_width"] is not None and summary["n"] >= spec["min_questions"]
+                            and width <= spec["ci_width"] and state[cell]["asked"] < total)
+                    if stop:
+                        state[cell]["stopped"] = number + 1
+                    print(f"   {format_cell(cell)}: {summary['accuracy']:.2f}% "
+                          f"({summary['ci_low']:.2f}-{summary['ci_high']:.2f}), N: {summary['n']}"
+                          f"{' -> stopped early' if stop else ''}")
+    finally:
+        store.close()
+        journal.close()
+        if cache is not None:
+            print(f"📦 {cache.summary()}")
+            cache.close()
+
+    summaries = {}
+    for cell in cells:
+        summaries[cell] = {
+            **cell_summary(state[cell]),
+            "failed": state[cell]["failed"],
+            "stopped": state[cell]["stopped"],
+            "skipped": total - state[cell]["asked"],
+        }
+    skipped = sum(s["skipped"] for s in summaries.values())
+    print(f"\n✅ Sweep {spec['name']} completed: {skipped} of {total * len(cells)} cell-question calls "
+          f"({skipped / max(total * len(cells), 1) * 100:.1f}%) skipped by early stopping")
+    save_sweep_csv(spec["name"], summaries)
+    return summaries
+
+
+def format_cell(cell):
+    return f"{variant_name(cell.model, cell.temperature)} | {strategy_label(cell.strategy, cell.k)}"
+
+
+def save_sweep_csv(name, summaries):
+    csv_path = os.path.join(os.path.dirname(LOG_PATH), f"sweep_{name}.csv")
+    with open(csv_path, "w", newline='', encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Model", "Temperature", "Strategy", "K", "N", "Accuracy", "CI Low", "CI High",
+                         "Failed Requests", "Stopped After Round", "Questions Skipped"])
+        for cell, s in summaries.items():
+            writer.writerow([
+                cell.model, "" if cell.temperature is None else cell.temperature, cell.strategy,
+                "" if cell.k is None else cell.k, s["n"], f"{s['accuracy']:.2f}", f"{s['ci_low']:.2f}",
+                f"{s['ci_high']:.2f}", s["failed"], s["stopped"] or "", s["skipped"],
+            ])
+    print(f"✅ Sweep results saved at {csv_path}")
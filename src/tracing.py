@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import heapq
+import random
+import hashlib
+import threading
+import contextlib
+import contextvars
+from array import array
+from collections import Counter, defaultdict
+from .config import RUNS_PATH
+
+TRACE_FORMATS = ("jsonl", "otlp", "off")
+TRACES_PATH = os.path.join(RUNS_PATH, "traces")
+SLOWEST_PROMPTS = 10
+TRACE_FLUSH_SPANS = 1000  # Spans buffered in memory before they are appended to the trace file
+# Spans that only group other spans; the report ranks every other span name as a stage
+CONTAINER_SPANS = {"run", "category", "dataset", "request"}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_tracer = None
+
+
+def prompt_key(prompt):
+    """Short stable id of a prompt's text, used to link request spans to tracking ids."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class Tracer:
+    """
+    Spans and counters of one run. Spans use OpenTelemetry field names
+    (trace_id, span_id, parent_span_id, start/end_time_unix_nano, attributes)
+    and nest through a context variable, so asyncio tasks inherit their parent.
+    Spans are appended to the trace file at `path` as they close, TRACE_FLUSH_SPANS
+    at a time, so memory stays flat however many requests a run sends: "jsonl"
+    writes one record per line, "otlp" one OTLP/JSON export request per flush, as
+    the collector file exporter does. Counters are few and written by close().
+    """
+
+    def __init__(self, run_id, path, fmt="jsonl"):
+        self.run_id = run_id
+        self.path = path
+        self.fmt = fmt
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.counters = Counter()
+        self.labels = {}  # Prompt key -> tracking id, for the prompts of the latest batch only
+        self._buffer = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, "w", encoding="utf-8")
+
+    def add_span(self, name, start_ns, end_ns, attributes, span_id=None, parent_span_id=None):
+        record = {
+            "type": "span",
+            "trace_id": self.trace_id,
+            "span_id": span_id or f"{random.getrandbits(64):016x}",
+            "parent_span_id": parent_span_id if span_id else _current_span.get(),
+            "name": name,
+            "start_time_unix_nano": start_ns,
+            "end_time_unix_nano": end_ns,
+            "attributes": attributes,
+        }
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= TRACE_FLUSH_SPANS:
+                self._flush()
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        span_id = f"{random.getrandbits(64):016x}"
+        parent = _current_span.get()
+        token = _current_span.set(span_id)
+        start = time.time_ns()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.add_span(name, start, time.time_ns(), attributes, span_id, parent)
+
+    def count(self, name, value=1, **attributes):
+        with self._lock:
+            self.counters[(name, tuple(sorted(attributes.items())))] += value
+
+    def label_prompts(self, prompts, labels):
+        """Names the prompts of one batch; request spans of earlier batches are written with their own labels first."""
+        with self._lock:
+            self._flush()
+            self.labels = {}
+            for prompt, label in zip(prompts, labels):
+                self.labels.setdefault(prompt_key(prompt), label)
+            if self.fmt == "jsonl":
+                self._buffer += [{"type": "label", "prompt": key, "label": label} for key, label in self.labels.items()]
+                self._flush()
+
+    def _flush(self):
+        """Appends the buffered records to the trace file (callers hold the lock)."""
+        if not self._buffer:
+            return
+        lines = self._buffer if self.fmt == "jsonl" else [_otlp_spans(self, self._buffer)]
+        self._file.write("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines))
+        self._buffer = []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self.fmt == "jsonl":
+                lines = [{"type": "counter", "name": name, "attributes": dict(attributes), "value": value}
+                         for (name, attributes), value in self.counters.items()]
+            else:
+                lines = [_otlp_metrics(self)] if self.counters else []
+            self._file.write("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines))
+            self._file.close()
+
+
+# Module-level tracer: instrumented code calls span() / add_span() / count() and
+# they do nothing unless a run started a trace.
+
+def start_trace(run_id, fmt="jsonl"):
+    """Starts tracing to runs/traces/<run_id>.jsonl, or .otlp.jsonl for fmt "otlp"."""
+    global _tracer
+    _tracer = Tracer(run_id, trace_path(run_id, fmt), fmt)
+    return _tracer
+
+
+def span(name, **attributes):
+    """Context manager timing a stage; yields its attribute dict so callers can add results."""
+    return _tracer.span(name, **attributes) if _tracer else contextlib.nullcontext(attributes)
+
+
+def add_span(name, start_ns, end_ns, **attributes):
+    if _tracer:
+        _tracer.add_span(name, start_ns, end_ns, attributes)
+
+
+def count(name, value=1, **attributes):
+    if _tracer:
+        _tracer.count(name, value, **attributes)
+
+
+def label_prompts(prompts, labels):
+    if _tracer:
+        _tracer.label_prompts(prompts, labels)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def _otlp_resource(tracer):
+    return {"attributes": _otlp_attributes({"service.name": "indiceval", "run.id": tracer.run_id})}
+
+
+def _otlp_spans(tracer, spans):
+    """One OTLP/JSON span export request, labelling request spans with the tracer's current prompt labels."""
+    return {"resourceSpans": [{"resource": _otlp_resource(tracer), "scopeSpans": [{"scope": {"name": "indiceval"}, "spans": [{
+        "traceId": s["trace_id"],
+        "spanId": s["span_id"],
+        "parentSpanId": s["parent_span_id"] or "",
+        "name": s["name"],
+        "kind": 1,
+        "startTimeUnixNano": str(s["start_time_unix_nano"]),
+        "endTimeUnixNano": str(s["end_time_unix_nano"]),
+        "attributes": _otlp_attributes({**s["attributes"], **(
+            {"prompt.label": tracer.labels[s["attributes"]["prompt"]]}
+            if s["attributes"].get("prompt") in tracer.labels else {}
+        )}),
+    } for s in spans]}]}]}
+
+
+def _otlp_metrics(tracer):
+    """One OTLP/JSON metric export request with the counters as monotonic sums."""
+    now = str(time.time_ns())
+    metrics = defaultdict(list)
+    for (name, attributes), value in tracer.counters.items():
+        metrics[name].append({"attributes": _otlp_attributes(dict(attributes)), "asInt": str(value), "timeUnixNano": now})
+    return {"resourceMetrics": [{"resource": _otlp_resource(tracer), "scopeMetrics": [{"scope": {"name": "indiceval"}, "metrics": [
+        {"name": name, "sum": {"dataPoints": points, "aggregationTemporality": 2, "isMonotonic": True}}
+        for name, points in metrics.items()
+    ]}]}]}
+
+
+def trace_path(run_id, fmt="jsonl"):
+    return os.path.join(TRACES_PATH, f"{run_id}.jsonl" if fmt == "jsonl" else f"{run_id}.otlp.jsonl")
+
+
+def finish_trace():
+    """Stops tracing and closes the trace file. Returns its path (None if no trace was started)."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return None
+    tracer.close()
+    return tracer.path
+
+
+def _otlp_plain(attributes):
+    plain = {}
+    for attribute in attributes:
+        (kind, value), = attribute["value"].items()
+        plain[attribute["key"]] = int(value) if kind == "intValue" else value
+    return plain
+
+
+def load_trace(path):
+    """Yields the records of a trace file (either format) as JSONL-style records."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            data = json.loads(line)
+            if "type" in data:
+                yield data
+                continue
+            for resource in data.get("resourceSpans", []):
+                for scope in resource["scopeSpans"]:
+                    for s in scope["spans"]:
+                        attributes = _otlp_plain(s["attributes"])
+                        if "prompt.label" in attributes:
+                            yield {"type": "label", "prompt": attributes["prompt"], "label": attributes.pop("prompt.label")}
+                        yield {
+                            "type": "span", "trace_id": s["traceId"], "span_id": s["spanId"],
+                            "parent_span_id": s["parentSpanId"] or None, "name": s["name"],
+                            "start_time_unix_nano": int(s["startTimeUnixNano"]),
+                            "end_time_unix_nano": int(s["endTimeUnixNano"]), "attributes": attributes,
+                        }
+            for resource in data.get("resourceMetrics", []):
+                for scope in resource["scopeMetrics"]:
+                    for metric in scope["metrics"]:
+                        for point in metric["sum"]["dataPoints"]:
+                            yield {"type": "counter", "name": metric["name"],
+                                   "attributes": _otlp_plain(point["attributes"]), "value": int(point["asInt"])}
+
+
+def trace_report(paths, slowest=SLOWEST_PROMPTS):
+    """
+    Text summary of the trace files in `paths` (one per shard of a run): stage
+    time shares, per-model request latency, slowest prompts, counters. The files
+    are streamed, keeping only per-stage and per-model totals, request latencies
+    and the slowest requests; a second pass looks up the slowest prompts' labels.
+    """
+    import numpy as np
+
+    first = last = None
+    stages = defaultdict(lambda: [0.0, 0])  # Name -> [total seconds, spans]
+    models = {}
+    top = []  # Min-heap of the slowest requests: (seconds, sequence number, attributes)
+    counters = []
+    for number, r in enumerate(r for path in paths for r in load_trace(path)):
+        if r["type"] == "counter":
+            counters.append(r)
+        if r["type"] != "span":
+            continue
+        first = r["start_time_unix_nano"] if first is None else min(first, r["start_time_unix_nano"])
+        last = r["end_time_unix_nano"] if last is None else max(last, r["end_time_unix_nano"])
+        seconds = (r["end_time_unix_nano"] - r["start_time_unix_nano"]) / 1e9
+        if r["name"] not in CONTAINER_SPANS:
+            stages[r["name"]][0] += seconds
+            stages[r["name"]][1] += 1
+        if r["name"] == "request":
+            a = r["attributes"]
+            m = models.setdefault(a["model"], {"latencies": array("d"), "wait": 0.0, "retries": 0, "hedges": 0, "failed": 0})
+            m["latencies"].append(seconds)
+            m["wait"] += a.get("queue_wait_ms", 0)
+            m["retries"] += a.get("retries", 0)
+            m["hedges"] += a.get("hedges", 0)
+            m["failed"] += a.get("status") != "ok"
+            if len(top) < slowest:
+                heapq.heappush(top, (seconds, number, a))
+            elif top and seconds > top[0][0]:
+                heapq.heapreplace(top, (seconds, number, a))
+    if first is None:
+        return "No spans recorded."
+    wall = (last - first) / 1e9
+
+    lines = [f"Run wall time: {wall:.2f}s", "", "Stages (by total time):"]
+    for name, (total, spans) in sorted(stages.items(), key=lambda item: -item[1][0]):
+        share = total / wall * 100 if wall else 0
+        lines.append(f"  {name:<14} {total:9.2f}s {share:5.1f}%  ({spans} spans)")
+
+    if models:
+        lines += ["", "Requests per model:"]
+        for model, m in sorted(models.items()):
+            latencies = np.sort(np.frombuffer(m["latencies"], dtype=np.float64))
+            lines.append(
+                f"  {model}: {len(latencies)} requests, p50 {latencies[len(latencies) // 2]:.2f}s, "
+                f"p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.2f}s, "
+                f"mean queue wait {m['wait'] / len(latencies):.0f} ms, "
+                f"{m['retries']} retries, {m['hedges']} hedged, {m['failed']} failed"
+            )
+
+        wanted = {a.get("prompt") for *_, a in top}
+        labels = {r["prompt"]: r["label"] for path in paths for r in load_trace(path)
+                  if r["type"] == "label" and r["prompt"] in wanted}
+        lines += ["", f"Slowest {len(top)} prompts:"]
+        for seconds, _, a in sorted(top, key=lambda item: (-item[0], item[1])):
+            lines.append(
+                f"  {seconds:7.2f}s {a['model']:<10} {labels.get(a.get('prompt'), a.get('prompt'))} "
+                f"(queue wait {a.get('queue_wait_ms', 0):.0f} ms, {a.get('retries', 0)} retries, {a.get('status')})"
+            )
+
+    if counters:
+        lines += ["", "Counters:"]
+        for r in sorted(counters, key=lambda r: (r["name"], sorted(r["attributes"].items()))):
+            attributes = ", ".join(f"{k}={v}" for k, v in sorted(r["attributes"].items()))
+            lines.append(f"  {r['name']} [{attributes}]: {r['value']}")
+    return "\n".join(lines)
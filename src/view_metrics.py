@@ -1,81 +1,146 @@
 import os
-import json
 import csv
-from sklearn.metrics import precision_score, recall_score, confusion_matrix
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pyarrow.compute as pc
 
-from .config import RESULTS_PATH, LOG_PATH
+from .config import RESULTS_PATH, RESULTS_STORE_PATH, LOG_PATH, CONFIDENCE
+from .results_store import latest_partitions, iter_partition, import_legacy_json
+from .metrics import LABELS, label_metrics, language_metrics, paired_language_deltas, item_languages, dataset_language
+from .dataset_loader import open_index
+from .metrics_cache import MetricsCache, partition_fingerprint
+from . import tracing
 
 
 def view_metrics():
-    if not os.path.exists(RESULTS_PATH):
+    partitions = latest_partitions()
+
+    # Results from before the columnar store: import the JSON tree once
+    if not partitions and os.path.exists(RESULTS_PATH):
+        print(f"📥 Importing legacy JSON results from {RESULTS_PATH}")
+        import_legacy_json()
+        partitions = latest_partitions()
+
+    if not partitions:
         print("❌ No benchmark results found. Run the benchmark first.")
         return
 
+    print(f"🔍 Checking Results Store: {RESULTS_STORE_PATH}")
+
+    # Partitions are only re-read when their fingerprint changed since the last aggregation
+    with tracing.span("metrics", partitions=len(partitions)) as span:
+        partition_metrics, languages, deltas, recomputed = aggregate(partitions)
+        span["recomputed"] = recomputed
+    print(f"♻️ {len(partitions) - recomputed} partitions unchanged, {recomputed} recomputed")
+
+    write_log(partition_metrics, languages, deltas)
+    save_csv(partition_metrics, languages, deltas)
+
+
+def partition_summary(partition_path):
+    """label_metrics() of one result partition plus its "index" array and failed-request count."""
+    predicted, correct, indices = [], [], []
+    failed = 0
+    for batch in iter_partition(partition_path, columns=["index", "predicted_answer", "correct_answer", "error"]):
+        # Failed requests have no answer to score: they are counted, not graded as wrong
+        if "error" in batch.schema.names:
+            failed += len(batch) - batch.column("error").null_count
+            batch = batch.filter(pc.is_null(batch.column("error")))
+        predicted += batch.column("predicted_answer").to_pylist()
+        correct += batch.column("correct_answer").to_pylist()
+        indices += batch.column("index").to_pylist()
+    metrics = label_metrics(predicted, correct)
+    metrics["index"] = np.asarray(indices, dtype=np.int64)
+    metrics["failed"] = failed
+    return metrics
+
+
+def aggregate(partitions, workers=None):
+    """
+    Per-partition, per-language and paired-delta metrics, recomputing only partitions that changed.
+    Changed partitions are scored in `workers` processes (default: one per core).
+    """
+    cache = MetricsCache()
+    fingerprints = {key: partition_fingerprint(path) for key, path in partitions.items()}
+    stale = sorted(key for key in partitions if not cache.fresh(["partition", *key], fingerprints[key]))
+    for model_name, prompt_type, dataset_name in stale:
+        print(f"      📄 Processing Dataset: {model_name} / {prompt_type} / {dataset_name}")
+    workers = min(workers or os.cpu_count() or 1, len(stale))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            computed = dict(zip(stale, pool.map(partition_summary, [partitions[key] for key in stale])))
+    else:
+        computed = {key: partition_summary(partitions[key]) for key in stale}
+
+    partition_metrics = {}
+    seen_models = set()
+    for key, partition_path in sorted(partitions.items()):
+        model_name, prompt_type, dataset_name = key
+        if model_name not in seen_models:
+            print(f"📂 Found Model: {model_name}")
+            seen_models.add(model_name)
+        partition_metrics[key] = cache.memo(["partition", *key], fingerprints[key], lambda key=key: computed[key])
+
+    recomputed = cache.misses
+    languages = language_metrics(partition_metrics, cache.memo, fingerprints, dataset_languages(partitions))
+    deltas = paired_language_deltas(partition_metrics, cache.memo, fingerprints, parallel_pairs(partitions))
+    cache.save()
+    return partition_metrics, languages, deltas, recomputed
+
+
+def dataset_languages(partitions):
+    """Per-item language codes of every dataset in `partitions` that has a metadata index."""
+    languages = {}
+    for dataset_name in {dataset for _, _, dataset in partitions}:
+        index = open_index(dataset_name)
+        if index is not None:
+            languages[dataset_name] = (index.languages, index.key)
+    return languages
+
+
+def parallel_pairs(partitions):
+    """Item pairing of every Hindi dataset in `partitions` whose metadata index knows its English original."""
+    pairs = {}
+    for dataset_name in {dataset for _, _, dataset in partitions}:
+        index = open_index(dataset_name)
+        if index is not None and index.pairs is not None:
+            pairs[dataset_name] = (index.pairs, index.fingerprint)
+    return pairs
+
+
+def write_log(partition_metrics, languages, deltas):
+    ci = f"{CONFIDENCE * 100:.0f}% CI"
     log_data = []
-    structured_results = {}
-
-    print(f"🔍 Checking Results Directory: {RESULTS_PATH}")
-
-    for model_name in os.listdir(RESULTS_PATH):
-        model_path = os.path.join(RESULTS_PATH, model_name)
-        if not os.path.isdir(model_path):
-            continue
-
-        print(f"📂 Found Model: {model_name}")
-        structured_results[model_name] = {}
-
-        for prompt_type in os.listdir(model_path):
-            prompt_path = os.path.join(model_path, prompt_type)
-            if not os.path.isdir(prompt_path):
-                continue
-
-            print(f"   📂 Found Prompting Type: {prompt_type}")
-            structured_results[model_name][prompt_type] = {}
-
-            for file_name in os.listdir(prompt_path):
-                if not file_name.endswith(".json"):
-                    continue
-
-                dataset_name = file_name.replace(".json", "")
-                dataset_file = os.path.join(prompt_path, file_name)
-
-                print(f"      📄 Processing Dataset: {dataset_name}")
-
-                with open(dataset_file, "r", encoding="utf-8") as f:
-                    dataset_results = json.load(f)
-
-                correct_count = sum(1 for item in dataset_results if item["is_correct"])
-                total_questions = len(dataset_results)
-                accuracy = (correct_count / total_questions) * 100 if total_questions > 0 else 0
-
-                # Extract binary ground truth and predictions
-                y_true = [1 if item["predicted_answer"] == item["correct_answer"] else 0 for item in dataset_results]
-                y_pred = [1 if item["is_correct"] else 0 for item in dataset_results]
-
-                # Calculate precision, recall, and confusion matrix
-                try:
-                    precision = precision_score(y_true, y_pred, zero_division=0) * 100
-                    recall = recall_score(y_true, y_pred, zero_division=0) * 100
-                    tn, fp, fn, tp = confusion_matrix(y_true, y_pred).ravel()
-                except Exception as e:
-                    precision = recall = tn = fp = fn = tp = 0
-                    print(f"⚠️ Metrics calculation failed for {dataset_name}: {e}")
-
-                # Save metrics
-                structured_results[model_name][prompt_type][dataset_name] = {
-                    "accuracy": accuracy,
-                    "precision": precision,
-                    "recall": recall,
-                    "tp": tp,
-                    "tn": tn,
-                    "fp": fp,
-                    "fn": fn
-                }
-
-                log_data.append(
-                    f"{model_name} | {prompt_type} | {dataset_name} "
-                    f"=> Accuracy: {accuracy:.2f}%, Precision: {precision:.2f}%, Recall: {recall:.2f}%, TP: {tp}, FP: {fp}, FN: {fn}, TN: {tn}"
-                )
+    for (model_name, prompt_type, dataset_name), m in partition_metrics.items():
+        log_data.append(
+            f"{model_name} | {prompt_type} | {dataset_name} "
+            f"=> Accuracy: {m['accuracy']:.2f}% ({ci} {m['ci_low']:.2f}-{m['ci_high']:.2f}), "
+            f"Macro Precision: {m['macro_precision']:.2f}%, Macro Recall: {m['macro_recall']:.2f}%, "
+            f"Extraction Failures: {m['failure_rate']:.2f}%, N: {m['n']}, Failed Requests: {m.get('failed', 0)}"
+        )
+
+    log_data.append("\nPer-language accuracy:")
+    for (model_name, prompt_type, language), m in sorted(languages.items()):
+        log_data.append(
+            f"{model_name} | {prompt_type} | {language} "
+            f"=> Accuracy: {m['accuracy']:.2f}% ({ci} {m['ci_low']:.2f}-{m['ci_high']:.2f}), N: {m['n']}"
+        )
+
+    log_data.append("\nHindi vs English (paired parallel items):")
+    for (model_name, prompt_type, english, hindi), d in sorted(deltas.items()):
+        log_data.append(
+            f"{model_name} | {prompt_type} | {hindi} - {english} "
+            f"=> Delta: {d['delta']:+.2f} pts ({ci} {d['ci_low']:+.2f} to {d['ci_high']:+.2f}), "
+            f"English: {d['english_accuracy']:.2f}%, Hindi: {d['hindi_accuracy']:.2f}%, Pairs: {d['pairs']}"
+        )
+
+    log_data.append("\nConfusion matrices (rows: true label, columns: predicted label):")
+    header = "      " + " ".join(f"{label:>5}" for label in LABELS + ["inv"])
+    for (model_name, prompt_type, dataset_name), m in partition_metrics.items():
+        log_data.append(f"{model_name} | {prompt_type} | {dataset_name}")
+        log_data.append(header)
+        for label, row in zip(LABELS, m["confusion"]):
+            log_data.append(f"    {label} " + " ".join(f"{count:>5}" for count in row))
 
     # Save log.txt
     os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
@@ -84,30 +149,50 @@ def view_metrics():
 
     print(f"\n✅ Evaluation Completed. Results saved in {LOG_PATH}")
 
-    save_csv(structured_results)
-
 
-def save_csv(structured_results):
+def save_csv(partition_metrics, languages, deltas):
     csv_path = LOG_PATH.replace(".txt", ".csv")
+    codes = dataset_languages(partition_metrics)
 
     with open(csv_path, "w", newline='', encoding="utf-8") as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(["Model", "Prompt Type", "Dataset", "Accuracy", "Precision", "Recall", "TP", "FP", "FN", "TN"])
-
-        for model in structured_results:
-            for prompt_type in structured_results[model]:
-                for dataset, metrics in structured_results[model][prompt_type].items():
-                    writer.writerow([
-                        model,
-                        prompt_type,
-                        dataset,
-                        f"{metrics['accuracy']:.2f}",
-                        f"{metrics['precision']:.2f}",
-                        f"{metrics['recall']:.2f}",
-                        metrics['tp'],
-                        metrics['fp'],
-                        metrics['fn'],
-                        metrics['tn']
-                    ])
-
-    print(f"✅ CSV Results saved at {csv_path}")
+        writer.writerow(["Model", "Prompt Type", "Dataset", "Language", "N", "Accuracy", "CI Low", "CI High",
+                         "Macro Precision", "Macro Recall", "Extraction Failure Rate", "Failed Requests"])
+
+        for (model, prompt_type, dataset), m in partition_metrics.items():
+            writer.writerow([
+                model,
+                prompt_type,
+                dataset,
+                # Per-item languages from the dataset index, e.g. "en/hi" for a mixed dataset
+                "/".join(np.unique(item_languages(m, dataset, codes.get(dataset, (None, None))[0])))
+                or dataset_language(dataset),
+                m['n'],
+                f"{m['accuracy']:.2f}",
+                f"{m['ci_low']:.2f}",
+                f"{m['ci_high']:.2f}",
+                f"{m['macro_precision']:.2f}",
+                f"{m['macro_recall']:.2f}",
+                f"{m['failure_rate']:.2f}",
+                m.get('failed', 0),
+            ])
+
+    languages_path = LOG_PATH.replace(".txt", "_languages.csv")
+    with open(languages_path, "w", newline='', encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Model", "Prompt Type", "Language", "N", "Accuracy", "CI Low", "CI High"])
+        for (model, prompt_type, language), m in sorted(languages.items()):
+            writer.writerow([model, prompt_type, language, m['n'],
+                             f"{m['accuracy']:.2f}", f"{m['ci_low']:.2f}", f"{m['ci_high']:.2f}"])
+
+    deltas_path = LOG_PATH.replace(".txt", "_deltas.csv")
+    with open(deltas_path, "w", newline='', encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Model", "Prompt Type", "English Dataset", "Hindi Dataset", "Pairs",
+                         "English Accuracy", "Hindi Accuracy", "Delta", "CI Low", "CI High"])
+        for (model, prompt_type, english, hindi), d in sorted(deltas.items()):
+            writer.writerow([model, prompt_type, english, hindi, d['pairs'],
+                             f"{d['english_accuracy']:.2f}", f"{d['hindi_accuracy']:.2f}",
+                             f"{d['delta']:.2f}", f"{d['ci_low']:.2f}", f"{d['ci_high']:.2f}"])
+
+    print(f"✅ CSV Results saved at {csv_path}, {languages_path} and {deltas_path}")